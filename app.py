@@ -1,23 +1,57 @@
 import os
+import re
+import mimetypes
 import logging
+import threading
 from datetime import datetime
 from dotenv import load_dotenv
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, send_from_directory
 from flask_jwt_extended import JWTManager
 from flask_compress import Compress
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from sqlalchemy import text
+from werkzeug.security import safe_join
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib encoder
+    orjson = None
 
 load_dotenv()
 
-from config import config
+from config import config, GUNICORN_THREADS
 from models import db, SuperAdmin, Admin
-from face_service import face_service
+from precompress_static import ENCODINGS, compress as compress_bytes
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
 env = os.getenv('FLASK_ENV', 'development')
 app.config.from_object(config[env])
 
+# Keep every compiled template; the set is small and fixed
+app.jinja_options = {**app.jinja_options, 'cache_size': -1}
+
+# API responses are built from to_dict() rows; emit them in insertion order
+# instead of re-sorting every dict's keys on each jsonify
+app.json.sort_keys = False
+
+if orjson is not None:
+    class OrjsonProvider(DefaultJSONProvider):
+        """jsonify through orjson's C encoder; datetimes still go through Flask's default"""
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(
+                obj,
+                default=self.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY,
+            ).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+    
+    app.json = OrjsonProvider(app)
+
 # Enable CORS for API endpoints
 CORS(app, resources={
     r"/api/*": {
@@ -28,6 +62,12 @@ CORS(app, resources={
 })
 
 db.init_app(app)
+
+# --preload opens pooled connections in the master; forked workers must not reuse them
+with app.app_context():
+    _engine = db.engine
+os.register_at_fork(after_in_child=lambda: _engine.dispose(close=False))
+
 jwt = JWTManager(app)
 compress = Compress(app)
 
@@ -37,89 +77,171 @@ logger = logging.getLogger(__name__)
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['FACE_DATA_FOLDER'], exist_ok=True)
 
-def init_database():
-    """Initialize database with default users"""
-    with app.app_context():
-        db.create_all()
-        
-        if SuperAdmin.query.count() == 0:
-            superadmin = SuperAdmin(
-                name="Super Admin",
-                email="superadmin@admin.com"
-            )
-            superadmin.set_password("superadmin123")
-            db.session.add(superadmin)
-            logger.info("Created default super admin")
-        
-        if Admin.query.count() == 0:
-            admin = Admin(
-                name="Admin",
-                email="admin@admin.com",
-                department="IT"
-            )
-            admin.set_password("admin123")
-            db.session.add(admin)
-            logger.info("Created default admin")
-        
-        db.session.commit()
-        logger.info("Database initialized")
+def _acquire_init_lock():
+    """Serialize first-run initialization across gunicorn workers (PostgreSQL only).
 
-@app.route('/')
-def index():
-    response = render_template('index.html')
-    return response
+    Uses a transaction-scoped advisory lock, released on commit/rollback.
+    Returns False if another worker already holds it.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return True
+    return bool(db.session.execute(text('SELECT pg_try_advisory_xact_lock(42)')).scalar())
 
-@app.route('/login')
-def login_page():
-    return render_template('login.html')
+def _database_ready():
+    """One-row probe: the schema exists and has been seeded (no catalog introspection)"""
+    try:
+        return db.session.execute(text(f'SELECT 1 FROM {SuperAdmin.__tablename__} LIMIT 1')).first() is not None
+    except Exception:
+        db.session.rollback()
+        return False
 
-@app.route('/register')
-def register_page():
-    return render_template('register.html')
+# Columns the models select that older databases lack; create_all only makes whole
+# tables, and not every start command runs the migration scripts
+ADDED_COLUMNS = [
+    ('persons', 'embedding_dtype', 'VARCHAR(8)'),
+]
 
-@app.route('/superadmin/dashboard')
-def superadmin_dashboard():
-    return render_template('superadmin/dashboard_enhanced.html')
+def _ensure_added_columns():
+    """Add any missing ADDED_COLUMNS (a LIMIT 0 probe per column, no catalog introspection)"""
+    for table, column, ddl in ADDED_COLUMNS:
+        try:
+            db.session.execute(text(f'SELECT {column} FROM {table} LIMIT 0'))
+            continue
+        except Exception:
+            db.session.rollback()
+        try:
+            # A missing table is left to create_all; a concurrent worker may win the ALTER
+            db.session.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+            db.session.commit()
+            logger.info(f"Added {table}.{column} column")
+        except Exception:
+            db.session.rollback()
 
-@app.route('/superadmin/cameras')
-def superadmin_cameras():
-    return render_template('superadmin/cameras.html')
+def init_database():
+    """Initialize database with default users (idempotent, runs once per database)
 
-@app.route('/superadmin/admins')
-def superadmin_admins():
-    return render_template('superadmin/admins.html')
+    Set DB_INIT=1 (e.g. in a deploy hook) to force create_all for new tables.
+    """
+    with app.app_context():
+        try:
+            _ensure_added_columns()
+            if os.getenv('DB_INIT') != '1' and _database_ready():
+                logger.info("Database already initialized")
+                return
+            
+            if not _acquire_init_lock():
+                logger.info("Database initialization running in another worker, skipping")
+                return
+            
+            db.create_all()
+            
+            if db.session.query(SuperAdmin.id).first() is None:
+                superadmin = SuperAdmin(
+                    name="Super Admin",
+                    email="superadmin@admin.com"
+                )
+                superadmin.set_password("superadmin123")
+                db.session.add(superadmin)
+                logger.info("Created default super admin")
+            
+            if db.session.query(Admin.id).first() is None:
+                admin = Admin(
+                    name="Admin",
+                    email="admin@admin.com",
+                    department="IT"
+                )
+                admin.set_password("admin123")
+                db.session.add(admin)
+                logger.info("Created default admin")
+            
+            db.session.commit()
+            logger.info("Database initialized successfully")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error initializing database: {e}")
+            # Don't crash on init errors, let the app start
+
+# Page templates carry no per-request data, so render each once and reuse the bytes
+_html_cache = {}
+_html_cache_lock = threading.Lock()
+
+def _template_mtime(template_name):
+    return os.path.getmtime(app.jinja_env.get_template(template_name).filename)
+
+def _accepted_encoding():
+    """Best precompressed encoding the client accepts (br > gzip) and its file suffix"""
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] > 0:
+            return encoding, suffix
+    return None, None
 
-@app.route('/superadmin/users')
-def superadmin_users():
-    return render_template('superadmin/users.html')
+def _render_cached(template_name):
+    cached = _html_cache.get(template_name)
+    # In debug, re-render when the template file is edited
+    if cached is None or (app.debug and cached[1] != _template_mtime(template_name)):
+        with _html_cache_lock:
+            body = render_template(template_name).encode('utf-8')
+            mtime = _template_mtime(template_name) if app.debug else None
+            cached = _html_cache[template_name] = (body, mtime, {})
+    
+    body, _, encoded = cached
+    encoding, _ = _accepted_encoding()
+    if encoding is None:
+        response = Response(body, mimetype='text/html')
+    else:
+        # Compress each page once per encoding; Flask-Compress skips encoded responses
+        if encoding not in encoded:
+            encoded[encoding] = compress_bytes(body, encoding)
+        response = Response(encoded[encoding], mimetype='text/html')
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
 
-@app.route('/superadmin/logs')
-def superadmin_logs():
-    return render_template('superadmin/logs.html')
+def static_precompressed(filename):
+    """Static files, served from the .br/.gz written by precompress_static.py when present"""
+    encoding, suffix = _accepted_encoding()
+    precompressed = safe_join(app.static_folder, filename + suffix) if encoding is not None else None
+    if precompressed is not None and os.path.isfile(precompressed):
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(app.static_folder, filename + suffix, mimetype=mimetype,
+                                       max_age=app.get_send_file_max_age(filename))
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = app.send_static_file(filename)
+    response.vary.add('Accept-Encoding')
+    return response
 
-@app.route('/admin/dashboard')
-def admin_dashboard():
-    return render_template('admin/dashboard.html')
+app.view_functions['static'] = static_precompressed
 
-@app.route('/admin/enrollment')
-def admin_enrollment():
-    return render_template('admin/enrollment_enhanced.html')
+# Pages with no server-side data: URL -> (endpoint, template)
+PAGES = {
+    '/': ('index', 'index.html'),
+    '/login': ('login_page', 'login.html'),
+    '/register': ('register_page', 'register.html'),
+    '/superadmin/dashboard': ('superadmin_dashboard', 'superadmin/dashboard_enhanced.html'),
+    '/superadmin/cameras': ('superadmin_cameras', 'superadmin/cameras.html'),
+    '/superadmin/admins': ('superadmin_admins', 'superadmin/admins.html'),
+    '/superadmin/users': ('superadmin_users', 'superadmin/users.html'),
+    '/superadmin/logs': ('superadmin_logs', 'superadmin/logs.html'),
+    '/admin/dashboard': ('admin_dashboard', 'admin/dashboard.html'),
+    '/admin/enrollment': ('admin_enrollment', 'admin/enrollment_enhanced.html'),
+    '/admin/requests': ('admin_requests', 'admin/requests_enhanced.html'),
+    '/admin/enrollment-requests': ('admin_enrollment_requests', 'admin/enrollment_requests.html'),
+}
 
-@app.route('/admin/requests')
-def admin_requests():
-    return render_template('admin/requests_enhanced.html')
+def page():
+    return _render_cached(PAGES[request.url_rule.rule][1])
 
-@app.route('/admin/enrollment-requests')
-def admin_enrollment_requests():
-    return render_template('admin/enrollment_requests.html')
+for rule, (endpoint, _) in PAGES.items():
+    app.add_url_rule(rule, endpoint, page)
 
 @app.route('/user/dashboard')
 def user_dashboard():
     # Check if modern dashboard requested or default to modern
     use_modern = request.args.get('modern', 'true').lower() == 'true'
     if use_modern:
-        return render_template('user/dashboard_modern.html')
-    return render_template('user/dashboard_enhanced.html')
+        return _render_cached('user/dashboard_modern.html')
+    return _render_cached('user/dashboard_enhanced.html')
 
 from routes.auth import auth_bp
 from routes.admin_api import admin_api_bp
@@ -135,18 +257,37 @@ app.register_blueprint(user_api_bp, url_prefix='/api/user')
 app.register_blueprint(camera_api_bp, url_prefix='/api/cameras')
 app.register_blueprint(enrollment_api_bp, url_prefix='/api/enrollment')
 
+# Compile templates at startup instead of on each worker's first request
+for template_name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+    try:
+        app.jinja_env.get_template(template_name)
+    except Exception as e:
+        logger.warning(f"Could not precompile template {template_name}: {e}")
+
 # Start background worker for CPU-intensive tasks
 from background_worker import background_worker
 background_worker.start()
 logger.info("Background worker started")
 
 # Performance optimization - add caching headers for static assets
+_HASHED_ASSET = re.compile(r'\.[0-9a-f]{8,}\.(js|css|png|jpe?g|webp|svg|woff2?)$')
+
 @app.after_request
 def add_header(response):
-    # Cache static files for 1 hour
     if request.path.startswith('/static/'):
-        response.cache_control.max_age = 3600
+        # send_static_file already emits ETag/Last-Modified and answers 304s;
+        # content-hashed filenames never change, so let browsers keep them
+        if _HASHED_ASSET.search(request.path):
+            response.cache_control.max_age = 31536000
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.max_age = 3600
         response.cache_control.public = True
+    elif (request.method == 'GET' and response.status_code == 200
+          and response.mimetype == 'text/html' and not response.is_streamed):
+        # Strong ETag on rendered pages so revalidation returns 304 without a body
+        response.add_etag()
+        response.make_conditional(request)
     return response
 
 # Error handlers
@@ -154,7 +295,7 @@ def add_header(response):
 def not_found(error):
     if request.path.startswith('/api/'):
         return jsonify({'error': 'Endpoint not found'}), 404
-    return render_template('index.html'), 404
+    return _render_cached('index.html'), 404
 
 @app.errorhandler(500)
 def internal_error(error):
@@ -164,37 +305,25 @@ def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
 # Initialize database on startup (works with gunicorn too)
-with app.app_context():
-    try:
-        db.create_all()
-        
-        # Create default super admin if not exists
-        if SuperAdmin.query.count() == 0:
-            superadmin = SuperAdmin(
-                name="Super Admin",
-                email="superadmin@admin.com"
-            )
-            superadmin.set_password("superadmin123")
-            db.session.add(superadmin)
-            logger.info("Created default super admin")
-        
-        # Create default admin if not exists
-        if Admin.query.count() == 0:
-            admin = Admin(
-                name="Admin",
-                email="admin@admin.com",
-                department="IT"
-            )
-            admin.set_password("admin123")
-            db.session.add(admin)
-            logger.info("Created default admin")
-        
-        db.session.commit()
-        logger.info("Database initialized successfully")
-    except Exception as e:
-        logger.error(f"Error initializing database: {e}")
-        # Don't crash on init errors, let the app start
+init_database()
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
+    if env == 'production':
+        # Each MJPEG stream holds a connection open, so serve with threaded workers.
+        # gevent is avoided on purpose: monkey-patching would turn the OpenCV capture
+        # threads into greenlets that block the hub inside grab()/retrieve().
+        # --preload imports the app once in the master, so init_database runs once.
+        os.execvp('gunicorn', [
+            'gunicorn',
+            '--worker-class', 'gthread',
+            '--workers', os.getenv('WEB_CONCURRENCY', '4'),
+            '--threads', str(GUNICORN_THREADS),
+            '--timeout', '120',
+            '--preload',
+            '--bind', f'0.0.0.0:{port}',
+            '--access-logfile', '-',
+            '--error-logfile', '-',
+            'app:app'
+        ])
     app.run(host='0.0.0.0', port=port, debug=(env == 'development'))
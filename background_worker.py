@@ -1,16 +1,91 @@
 """
 Background Worker for CPU-intensive tasks
-Handles face embedding generation asynchronously
+Handles face embedding generation asynchronously in worker processes
 """
 import threading
-import queue
+import multiprocessing
 import logging
-import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
 from typing import Callable, Any
 from datetime import datetime
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Face service loaded once per worker process by the pool initializer
+_face_service = None
+
+
+def _load_face_model():
+    """Pool initializer: load the face recognition model once per worker process"""
+    global _face_service
+    if _face_service is None:
+        from face_service import face_service
+        _face_service = face_service
+
+
+class _SharedArray:
+    """Picklable handle to an ndarray copied into shared memory"""
+    
+    def __init__(self, name: str, shape: tuple, dtype: str):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _share_arrays(args: tuple):
+    """
+    Move ndarray arguments into shared memory so only a small handle is pickled
+    Returns: (args with handles, list of SharedMemory segments owned by the caller)
+    """
+    shared_args = []
+    segments = []
+    for arg in args:
+        if isinstance(arg, np.ndarray) and arg.nbytes > 0:
+            shm = SharedMemory(create=True, size=arg.nbytes)
+            np.ndarray(arg.shape, dtype=arg.dtype, buffer=shm.buf)[:] = arg
+            segments.append(shm)
+            shared_args.append(_SharedArray(shm.name, arg.shape, arg.dtype.str))
+        else:
+            shared_args.append(arg)
+    return tuple(shared_args), segments
+
+
+def _release_segments(segments: list):
+    """Free shared memory once the worker is done with it"""
+    for shm in segments:
+        try:
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _run_task(func: Callable, args: tuple, kwargs: dict):
+    """Runs inside a worker process and reports when the task actually ran"""
+    started_at = datetime.utcnow()
+    attached = []
+    resolved = []
+    for arg in args:
+        if isinstance(arg, _SharedArray):
+            shm = SharedMemory(name=arg.name)
+            attached.append(shm)
+            resolved.append(np.ndarray(arg.shape, dtype=np.dtype(arg.dtype), buffer=shm.buf))
+        else:
+            resolved.append(arg)
+    
+    try:
+        result = func(*resolved, **kwargs)
+    finally:
+        del resolved
+        for shm in attached:
+            shm.close()
+    
+    return result, started_at, datetime.utcnow()
+
+
 class Task:
     """Background task wrapper"""
     
@@ -25,93 +100,106 @@ class Task:
         self.created_at = datetime.utcnow()
         self.started_at = None
         self.completed_at = None
+        # Display fields are formatted once, not on every status poll
+        self.created_at_iso = self.created_at.isoformat()
+        self.started_at_iso = None
+        self.completed_at_iso = None
+        self.duration = None
+        self.future = None
+        self.segments = []
+        self.done_event = threading.Event()
     
-    def execute(self):
-        """Execute the task"""
+    def attach(self, future, segments: list = None):
+        """Track the executor future running this task"""
+        self.future = future
+        self.segments = segments or []
+        future.add_done_callback(self._on_done)
+    
+    def _on_done(self, future):
+        """Record the outcome once the worker process finishes"""
+        _release_segments(self.segments)
+        self.segments = []
+        
         try:
-            self.status = 'running'
-            self.started_at = datetime.utcnow()
-            logger.info(f"Executing task {self.task_id}")
-            
-            self.result = self.func(*self.args, **self.kwargs)
+            self.result, self.started_at, self.completed_at = future.result()
             self.status = 'completed'
-            self.completed_at = datetime.utcnow()
-            
             logger.info(f"Task {self.task_id} completed in {(self.completed_at - self.started_at).total_seconds():.2f}s")
-            
         except Exception as e:
             self.status = 'failed'
             self.error = str(e)
             self.completed_at = datetime.utcnow()
             logger.error(f"Task {self.task_id} failed: {e}")
+        finally:
+            self.started_at_iso = self.started_at.isoformat() if self.started_at else None
+            self.completed_at_iso = self.completed_at.isoformat() if self.completed_at else None
+            if self.started_at and self.completed_at:
+                self.duration = (self.completed_at - self.started_at).total_seconds()
+            self.done_event.set()
     
     def to_dict(self):
         """Convert task to dictionary"""
+        status = self.status
+        if status == 'pending' and self.future is not None and self.future.running():
+            status = 'running'
+        
         return {
             'task_id': self.task_id,
-            'status': self.status,
+            'status': status,
             'result': self.result,
             'error': self.error,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'started_at': self.started_at.isoformat() if self.started_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
-            'duration': (self.completed_at - self.started_at).total_seconds() if self.completed_at and self.started_at else None
+            'created_at': self.created_at_iso,
+            'started_at': self.started_at_iso,
+            'completed_at': self.completed_at_iso,
+            'duration': self.duration
         }
 
 
 class BackgroundWorker:
-    """Background task worker with thread pool"""
+    """Background task worker with a process pool.
     
-    def __init__(self, num_workers: int = 2):
+    Embedding generation is CPU-bound Python/TensorFlow code, so threads
+    would serialize on the GIL; each pool process gets its own interpreter
+    and loads the face model once via the pool initializer.
+    """
+    
+    def __init__(self, num_workers: int = 2, max_tasks: int = 10000):
         self.num_workers = num_workers
-        self.task_queue = queue.Queue()
-        self.tasks = {}  # task_id -> Task
-        self.workers = []
+        self.tasks = OrderedDict()  # task_id -> Task, least recently finished first
+        self._max_tasks = max_tasks
         self.is_running = False
         self.lock = threading.Lock()
+        self._pool = None
         
         logger.info(f"BackgroundWorker initialized with {num_workers} workers")
     
     def start(self):
-        """Start worker threads"""
+        """Start accepting tasks"""
         if self.is_running:
             logger.warning("Worker already running")
             return
         
         self.is_running = True
-        
-        for i in range(self.num_workers):
-            worker = threading.Thread(target=self._worker_loop, args=(i,), daemon=True)
-            worker.start()
-            self.workers.append(worker)
-            logger.info(f"Worker thread {i} started")
-    
-    def _worker_loop(self, worker_id: int):
-        """Worker thread loop"""
-        logger.info(f"Worker {worker_id} starting loop")
-        
-        while self.is_running:
-            try:
-                # Get task from queue (timeout to check is_running periodically)
-                try:
-                    task = self.task_queue.get(timeout=1)
-                except queue.Empty:
-                    continue
-                
-                logger.info(f"Worker {worker_id} picked up task {task.task_id}")
-                
-                # Execute task
-                task.execute()
-                
-                # Mark task as done
-                self.task_queue.task_done()
-                
-            except Exception as e:
-                logger.error(f"Worker {worker_id} error: {e}")
+    
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """
+        Create the process pool on first use, in the process that submits work.
+        With gunicorn --preload this module is imported by the master, so a pool
+        created at start() would be inherited (queues and all) by every worker.
+        'spawn' keeps TensorFlow state out of the children.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_load_face_model
+            )
+            logger.info(f"Started process pool with {self.num_workers} workers")
+        return self._pool
     
     def submit_task(self, task_id: str, func: Callable, *args, **kwargs) -> str:
         """
         Submit a task for background execution
+        func and its arguments must be picklable (module-level function)
         Returns: task_id
         """
         with self.lock:
@@ -119,12 +207,34 @@ class BackgroundWorker:
                 logger.warning(f"Task {task_id} already exists")
                 return task_id
             
+            # Bounded history: drop the oldest entry instead of sweeping
+            while len(self.tasks) >= self._max_tasks:
+                self.tasks.popitem(last=False)
+            
             task = Task(task_id, func, args, kwargs)
             self.tasks[task_id] = task
-            self.task_queue.put(task)
             
-            logger.info(f"Task {task_id} queued (queue size: {self.task_queue.qsize()})")
-            return task_id
+            # Frames go through shared memory instead of being pickled down the pipe
+            shared_args, segments = _share_arrays(args)
+            try:
+                future = self._get_pool().submit(_run_task, func, shared_args, kwargs)
+            except Exception:
+                _release_segments(segments)
+                del self.tasks[task_id]
+                raise
+            task.attach(future, segments)
+            
+            logger.info(f"Task {task_id} queued")
+        
+        # Registered outside the lock: the callback runs inline if the future is already done
+        future.add_done_callback(lambda _: self._mark_finished(task_id))
+        return task_id
+    
+    def _mark_finished(self, task_id: str):
+        """Finished tasks move to the back so they outlive older history"""
+        with self.lock:
+            if task_id in self.tasks:
+                self.tasks.move_to_end(task_id)
     
     def get_task_status(self, task_id: str) -> dict:
         """Get status of a task"""
@@ -146,19 +256,20 @@ class BackgroundWorker:
     
     def wait_for_task(self, task_id: str, timeout: float = 30) -> dict:
         """Wait for task to complete"""
-        start_time = time.time()
+        with self.lock:
+            task = self.tasks.get(task_id)
+        if not task:
+            return {'error': 'Task not found'}
         
-        while time.time() - start_time < timeout:
-            status = self.get_task_status(task_id)
-            if status.get('status') in ['completed', 'failed']:
-                return status
-            time.sleep(0.1)
+        if task.done_event.wait(timeout):
+            return task.to_dict()
         
         return {'error': 'Timeout waiting for task'}
     
     def get_queue_size(self) -> int:
         """Get number of pending tasks"""
-        return self.task_queue.qsize()
+        with self.lock:
+            return sum(1 for task in self.tasks.values() if task.status == 'pending')
     
     def get_all_tasks(self) -> list:
         """Get all tasks"""
@@ -166,31 +277,28 @@ class BackgroundWorker:
             return [task.to_dict() for task in self.tasks.values()]
     
     def cleanup_old_tasks(self, max_age_seconds: int = 3600):
-        """Remove old completed/failed tasks"""
+        """Remove completed/failed tasks older than max_age_seconds (max_tasks caps the rest)"""
         with self.lock:
             now = datetime.utcnow()
-            to_remove = []
-            
-            for task_id, task in self.tasks.items():
-                if task.status in ['completed', 'failed']:
-                    if task.completed_at:
-                        age = (now - task.completed_at).total_seconds()
-                        if age > max_age_seconds:
-                            to_remove.append(task_id)
-            
+            to_remove = [
+                task_id for task_id, task in self.tasks.items()
+                if task.status in ('completed', 'failed') and task.completed_at
+                and (now - task.completed_at).total_seconds() > max_age_seconds
+            ]
             for task_id in to_remove:
                 del self.tasks[task_id]
-            
-            if to_remove:
-                logger.info(f"Cleaned up {len(to_remove)} old tasks")
+        
+        if to_remove:
+            logger.info(f"Cleaned up {len(to_remove)} old tasks")
     
     def stop(self):
         """Stop all workers"""
         logger.info("Stopping workers...")
         self.is_running = False
         
-        for worker in self.workers:
-            worker.join(timeout=5)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
         
         logger.info("All workers stopped")
 
@@ -200,21 +308,27 @@ background_worker = BackgroundWorker(num_workers=2)
 
 
 # Face embedding task wrapper
-def generate_face_embedding_task(image_path: str, face_service):
+def generate_face_embedding_task(image):
     """
     Task function for generating face embeddings
-    This runs in background to avoid blocking the main thread
+    Accepts an image path or a decoded BGR frame (handed over via shared memory)
+    Runs in a pool process to avoid blocking the web workers
     """
     try:
-        from PIL import Image
-        import numpy as np
+        import cv2
+        
+        _load_face_model()
         
-        # Load image
-        img = Image.open(image_path)
-        img_array = np.array(img)
+        # Load image (BGR, as the face service expects)
+        img_array = image if isinstance(image, np.ndarray) else cv2.imread(image)
+        if img_array is None:
+            return {
+                'success': False,
+                'error': 'Could not read image'
+            }
         
         # Generate embedding
-        embedding = face_service.get_face_embedding(img_array)
+        embedding = _face_service.extract_embedding(img_array)
         
         if embedding is not None:
             return {
@@ -3,15 +3,88 @@ Production-grade Camera Management System
 Supports multiple cameras (USB devices and IP/RTSP streams)
 """
 import cv2
+import sys
 import threading
 import time
 import numpy as np
-from datetime import datetime
 from typing import Dict, Optional, Tuple
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:  # PyTurboJPEG is optional, fall back to OpenCV's encoder
+    TurboJPEG = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional, fall back to OpenCV passes
+    njit = None
 
 logger = logging.getLogger(__name__)
 
+JPEG_QUALITY = 85
+
+# Capture backend for local devices: DirectShow on Windows, V4L2 on Linux
+if sys.platform.startswith('win'):
+    DEVICE_BACKEND = cv2.CAP_DSHOW
+elif sys.platform.startswith('linux'):
+    DEVICE_BACKEND = cv2.CAP_V4L2
+else:
+    DEVICE_BACKEND = cv2.CAP_ANY
+
+
+def _create_jpeg_encoder():
+    """Return a libjpeg-turbo encoder, or None if it isn't available"""
+    if TurboJPEG is None:
+        return None
+    try:
+        return TurboJPEG()
+    except Exception as e:
+        logger.warning(f"libturbojpeg not available, using OpenCV JPEG encoder: {e}")
+        return None
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _frame_quality_stats(bgr):
+        """Mean brightness and Laplacian variance of a BGR uint8 frame.
+        
+        Reads the frame once to build an 8-bit luma plane (BT.601 weights in
+        fixed point), then runs the 3x3 Laplacian over it with integer sums.
+        """
+        h, w = bgr.shape[0], bgr.shape[1]
+        gray = np.empty((h, w), dtype=np.uint8)
+        luma_sum = 0
+        for y in prange(h):
+            row_sum = 0
+            for x in range(w):
+                g = (29 * np.int32(bgr[y, x, 0]) + 150 * np.int32(bgr[y, x, 1])
+                     + 77 * np.int32(bgr[y, x, 2]) + 128) >> 8
+                gray[y, x] = g
+                row_sum += g
+            luma_sum += row_sum
+        
+        lap_sum = 0
+        lap_sq_sum = 0
+        for y in prange(1, h - 1):
+            row_sum = 0
+            row_sq_sum = 0
+            for x in range(1, w - 1):
+                v = (np.int32(gray[y - 1, x]) + np.int32(gray[y + 1, x])
+                     + np.int32(gray[y, x - 1]) + np.int32(gray[y, x + 1])
+                     - 4 * np.int32(gray[y, x]))
+                row_sum += v
+                row_sq_sum += v * v
+            lap_sum += row_sum
+            lap_sq_sum += row_sq_sum
+        
+        n = (h - 2) * (w - 2)
+        lap_mean = lap_sum / n
+        return luma_sum / (h * w), lap_sq_sum / n - lap_mean * lap_mean
+else:
+    _frame_quality_stats = None
+
+
 class CameraStream:
     """Individual camera stream handler"""
     
@@ -22,21 +95,30 @@ class CameraStream:
         
         # Stream properties
         self.capture = None
-        self.frame = None
         self.is_running = False
-        self.last_frame_time = None
+        self.last_frame_time = None  # time.monotonic() of the last good frame
         self.error_count = 0
         self.max_errors = 10
+        # Upper bound on buffered frames dropped per iteration for IP cameras
+        self.max_stale_grabs = 5
         
         # Health metrics
         self.total_frames = 0
         self.fps = 0
-        self.last_health_check = datetime.utcnow()
+        self.last_health_check = time.monotonic()
+        
+        # Triple buffer: the capture thread fills one slot while consumers
+        # read the latest completed one. The lock only guards the index swap.
+        self._buffers = [None, None, None]
+        self._latest_idx = None
         
         # Threading
         self.lock = threading.Lock()
         self.thread = None
         
+        # SIMD JPEG encoder for streaming (None -> cv2.imencode)
+        self._tj = _create_jpeg_encoder()
+        
         logger.info(f"Camera {camera_id} initialized with source: {source}")
     
     def start(self) -> bool:
@@ -48,14 +130,18 @@ class CameraStream:
         try:
             # Open capture
             if isinstance(self.source, int):
-                self.capture = cv2.VideoCapture(self.source, cv2.CAP_DSHOW)  # DirectShow for Windows
+                self.capture = cv2.VideoCapture(self.source, DEVICE_BACKEND)
             else:
-                self.capture = cv2.VideoCapture(self.source)
+                self.capture = cv2.VideoCapture(self.source, cv2.CAP_FFMPEG)
             
             if not self.capture.isOpened():
                 logger.error(f"Failed to open camera {self.camera_id}")
                 return False
             
+            # Ask USB cameras for MJPG before sizing: raw YUYV saturates USB 2.0 above 720p30
+            if isinstance(self.source, int):
+                self.capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+            
             # Set properties
             self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.config.get('width', 1280))
             self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.config.get('height', 720))
@@ -82,17 +168,25 @@ class CameraStream:
     def _capture_loop(self):
         """Continuous frame capture loop"""
         frame_interval = 1.0 / self.config.get('fps', 30)
+        write_idx = 0
         
         while self.is_running:
             try:
-                ret, frame = self.capture.read()
+                ret = self._grab_latest(frame_interval)
+                if ret:
+                    buf = self._buffers[write_idx]
+                    ret, frame = self.capture.retrieve(buf) if buf is not None else self.capture.retrieve()
                 
                 if ret:
+                    # OpenCV reuses buf when the frame size matches, otherwise allocates
+                    self._buffers[write_idx] = frame
                     with self.lock:
-                        self.frame = frame
-                        self.last_frame_time = datetime.utcnow()
-                        self.total_frames += 1
-                        self.error_count = 0
+                        self._latest_idx = write_idx
+                    write_idx = (write_idx + 1) % len(self._buffers)
+                    
+                    self.last_frame_time = time.monotonic()
+                    self.total_frames += 1
+                    self.error_count = 0
                     
                     # Calculate FPS
                     if self.total_frames % 30 == 0:
@@ -105,14 +199,37 @@ class CameraStream:
                     if self.error_count >= self.max_errors:
                         logger.error(f"Camera {self.camera_id} max errors reached, attempting restart")
                         self._restart()
-                
-                time.sleep(frame_interval)
+                    else:
+                        # Back off only on failure; successful reads are paced by grab()
+                        time.sleep(frame_interval)
                 
             except Exception as e:
                 logger.error(f"Error in capture loop for camera {self.camera_id}: {e}")
                 self.error_count += 1
                 time.sleep(1)
     
+    def _grab_latest(self, frame_interval: float) -> bool:
+        """Grab the newest frame without decoding the ones it skips.
+        
+        Network streams queue frames when we fall behind. Frames that are
+        already buffered come back from grab() almost at once. So keep
+        grabbing until a call blocks waiting for a live frame, which means
+        we have caught up. If the first grab already blocked, the stream is
+        caught up and that frame is kept.
+        """
+        start = time.monotonic()
+        if not self.capture.grab():
+            return False
+        
+        if isinstance(self.source, str) and time.monotonic() - start <= frame_interval / 4:
+            for _ in range(self.max_stale_grabs):
+                start = time.monotonic()
+                if not self.capture.grab():
+                    return False
+                if time.monotonic() - start > frame_interval / 4:
+                    break
+        return True
+    
     def _restart(self):
         """Restart camera stream"""
         logger.info(f"Restarting camera {self.camera_id}")
@@ -122,26 +239,38 @@ class CameraStream:
     
     def _update_fps(self):
         """Update FPS calculation"""
-        now = datetime.utcnow()
+        now = time.monotonic()
         if self.last_health_check:
-            delta = (now - self.last_health_check).total_seconds()
+            delta = now - self.last_health_check
             if delta > 0:
                 self.fps = 30 / delta
         self.last_health_check = now
     
+    def _latest_frame(self) -> Optional[np.ndarray]:
+        """Reference to the latest frame buffer (not a copy).
+        
+        The capture thread only comes back to this slot two frames later,
+        so short read-only consumers like the JPEG encoder can use it directly.
+        """
+        with self.lock:
+            idx = self._latest_idx
+        return self._buffers[idx] if idx is not None else None
+    
     def get_frame(self) -> Optional[np.ndarray]:
         """Get latest frame"""
-        with self.lock:
-            return self.frame.copy() if self.frame is not None else None
+        frame = self._latest_frame()
+        return frame.copy() if frame is not None else None
     
     def get_jpeg_frame(self) -> Optional[bytes]:
         """Get frame as JPEG bytes for streaming"""
-        frame = self.get_frame()
+        frame = self._latest_frame()
         if frame is None:
             return None
         
         try:
-            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            if self._tj is not None:
+                return self._tj.encode(frame, quality=JPEG_QUALITY, pixel_format=TJPF_BGR)
+            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
             return buffer.tobytes()
         except Exception as e:
             logger.error(f"Error encoding frame for camera {self.camera_id}: {e}")
@@ -149,29 +278,35 @@ class CameraStream:
     
     def get_health_status(self) -> dict:
         """Get camera health metrics"""
-        with self.lock:
-            age = (datetime.utcnow() - self.last_frame_time).total_seconds() if self.last_frame_time else None
-            
-            return {
-                'camera_id': self.camera_id,
-                'is_running': self.is_running,
-                'total_frames': self.total_frames,
-                'fps': round(self.fps, 2),
-                'error_count': self.error_count,
-                'last_frame_age': round(age, 2) if age else None,
-                'status': 'healthy' if self.is_running and age and age < 5 else 'unhealthy'
-            }
+        # Plain attribute reads written by the capture thread; no lock needed
+        last_frame_time = self.last_frame_time
+        age = time.monotonic() - last_frame_time if last_frame_time is not None else None
+        
+        return {
+            'camera_id': self.camera_id,
+            'is_running': self.is_running,
+            'total_frames': self.total_frames,
+            'fps': round(self.fps, 2),
+            'error_count': self.error_count,
+            'last_frame_age': round(age, 2) if age is not None else None,
+            'status': 'healthy' if self.is_running and age is not None and age < 5 else 'unhealthy'
+        }
     
     def apply_quality_checks(self, frame: np.ndarray) -> dict:
         """Analyze frame quality for enrollment"""
         try:
+            if _frame_quality_stats is not None and frame.ndim == 3 and min(frame.shape[:2]) > 2:
+                brightness, laplacian_var = _frame_quality_stats(np.ascontiguousarray(frame))
+            else:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                # 3x3 Laplacian of uint8 fits in int16, no need for CV_64F
+                laplacian_var = cv2.Laplacian(gray, cv2.CV_16S).var()
+                brightness = np.mean(gray)
+            
             # Blur detection using Laplacian variance
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
             blur_score = min(100, int(laplacian_var / 10))
             
             # Brightness check
-            brightness = np.mean(gray)
             brightness_score = 100 if 50 < brightness < 200 else int((brightness / 255) * 100)
             
             # Overall quality
@@ -205,7 +340,8 @@ class CameraStream:
             self.capture = None
         
         with self.lock:
-            self.frame = None
+            self._latest_idx = None
+        self._buffers = [None, None, None]
 
 
 class CameraManager:
@@ -275,53 +411,54 @@ class CameraManager:
     
     def get_frame(self, camera_id: int) -> Optional[np.ndarray]:
         """Get frame from specific camera"""
-        with self.lock:
-            camera = self.cameras.get(camera_id)
-            if camera:
-                return camera.get_frame()
+        # Reads skip the lock: dict lookups are atomic and only add/remove mutate
+        camera = self.cameras.get(camera_id)
+        if camera:
+            return camera.get_frame()
         return None
     
     def get_jpeg_frame(self, camera_id: int) -> Optional[bytes]:
         """Get JPEG frame for streaming"""
-        with self.lock:
-            camera = self.cameras.get(camera_id)
-            if camera:
-                return camera.get_jpeg_frame()
+        camera = self.cameras.get(camera_id)
+        if camera:
+            return camera.get_jpeg_frame()
         return None
     
     def get_all_cameras(self) -> list:
         """Get list of all cameras with status"""
-        with self.lock:
-            return [
-                {
-                    'id': cam_id,
-                    'source': cam.source,
-                    'config': cam.config,
-                    **cam.get_health_status()
-                }
-                for cam_id, cam in self.cameras.items()
-            ]
+        cameras = list(self.cameras.items())
+        return [
+            {
+                'id': cam_id,
+                'source': cam.source,
+                'config': cam.config,
+                **cam.get_health_status()
+            }
+            for cam_id, cam in cameras
+        ]
     
     def get_camera_health(self, camera_id: int) -> Optional[dict]:
         """Get health status for specific camera"""
-        with self.lock:
-            camera = self.cameras.get(camera_id)
-            if camera:
-                return camera.get_health_status()
+        camera = self.cameras.get(camera_id)
+        if camera:
+            return camera.get_health_status()
         return None
     
     def start_all(self):
-        """Start all cameras"""
-        with self.lock:
-            for camera in self.cameras.values():
-                if camera.config.get('enabled', True):
-                    camera.start()
+        """Start all cameras in parallel (opening an RTSP stream can take seconds)"""
+        cameras = [cam for cam in list(self.cameras.values()) if cam.config.get('enabled', True)]
+        self._run_parallel(lambda cam: cam.start(), cameras)
     
     def stop_all(self):
-        """Stop all cameras"""
-        with self.lock:
-            for camera in self.cameras.values():
-                camera.stop()
+        """Stop all cameras in parallel"""
+        self._run_parallel(lambda cam: cam.stop(), list(self.cameras.values()))
+    
+    @staticmethod
+    def _run_parallel(action, cameras: list):
+        if not cameras:
+            return
+        with ThreadPoolExecutor(max_workers=min(8, len(cameras))) as executor:
+            list(executor.map(action, cameras))
     
     def analyze_frame_quality(self, camera_id: int) -> Optional[dict]:
         """Analyze quality of current frame"""
@@ -329,10 +466,9 @@ class CameraManager:
         if frame is None:
             return None
         
-        with self.lock:
-            camera = self.cameras.get(camera_id)
-            if camera:
-                return camera.apply_quality_checks(frame)
+        camera = self.cameras.get(camera_id)
+        if camera:
+            return camera.apply_quality_checks(frame)
         return None
 
 
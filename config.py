@@ -1,6 +1,10 @@
 import os
 from datetime import timedelta
 
+# Request threads per gunicorn gthread worker; both launchers (app.py and
+# entrypoint.py) pass this to --threads, and the DB pool is sized from it
+GUNICORN_THREADS = int(os.getenv('GUNICORN_THREADS', 8))
+
 class Config:
     """Base configuration"""
     
@@ -14,7 +18,13 @@ class Config:
         database_url = database_url.replace('postgres://', 'postgresql://', 1)
     SQLALCHEMY_DATABASE_URI = database_url
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool per gunicorn worker: one connection per request thread plus two for
+    # background threads, with overflow kept small because every worker holds
+    # its own pool against max_connections
     SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', GUNICORN_THREADS + 2)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', max(GUNICORN_THREADS // 4, 2))),
+        'pool_timeout': 10,
         'pool_pre_ping': True,
         'pool_recycle': 300,
     }
@@ -47,6 +57,7 @@ class ProductionConfig(Config):
     """Production configuration"""
     DEBUG = False
     TESTING = False
+    TEMPLATES_AUTO_RELOAD = False
 
 class TestingConfig(Config):
     """Testing configuration"""
@@ -1,6 +1,78 @@
 from app import app, db
 from models import User, Person, SignupRequest, EnrollmentRequest, LeaveRequest, Attendance, SystemLog
 
+# Index DDL, sent to the database as one script
+INDEX_STATEMENTS = [
+    # User indexes
+    "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)",
+    "CREATE INDEX IF NOT EXISTS idx_users_status ON users(status)",
+    "CREATE INDEX IF NOT EXISTS idx_users_department ON users(department)",
+
+    # Person indexes
+    "CREATE INDEX IF NOT EXISTS idx_persons_user_id ON persons(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_persons_status ON persons(status)",
+
+    # SignupRequest indexes (the admin queue lists and counts pending requests)
+    "CREATE INDEX IF NOT EXISTS idx_signup_requests_pending ON signup_requests(submitted_at DESC) WHERE status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS idx_signup_requests_email ON signup_requests(email)",
+    "CREATE INDEX IF NOT EXISTS idx_signup_requests_submitted_at ON signup_requests(submitted_at)",
+
+    # EnrollmentRequest indexes
+    # A user's requests: the pending check and the latest-request lookup
+    "CREATE INDEX IF NOT EXISTS idx_enrollment_user_submitted ON enrollment_requests(user_id, submitted_at DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_enrollment_requests_status ON enrollment_requests(status)",
+    "CREATE INDEX IF NOT EXISTS idx_enrollment_requests_submitted_at ON enrollment_requests(submitted_at)",
+
+    # LeaveRequest indexes
+    "CREATE INDEX IF NOT EXISTS idx_leave_requests_user_id ON leave_requests(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_leave_requests_status ON leave_requests(status)",
+    "CREATE INDEX IF NOT EXISTS idx_leave_requests_start_date ON leave_requests(start_date)",
+
+    # Attendance indexes
+    "CREATE INDEX IF NOT EXISTS idx_attendance_person_id ON attendance(person_id)",
+    # Per-user history is filtered by user and ordered by time: one range scan
+    "CREATE INDEX IF NOT EXISTS idx_attendance_user_ts_cov ON attendance(user_id, timestamp DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_attendance_name_timestamp ON attendance(name, timestamp DESC)",
+    # Day filters are half-open ranges on timestamp (Attendance.on_date), not
+    # DATE(timestamp) = ..., so no separate expression index is kept
+    "CREATE INDEX IF NOT EXISTS idx_attendance_ts_cov ON attendance(timestamp DESC)",
+
+    # SystemLog indexes (the audit log is only ever listed newest first)
+    "CREATE INDEX IF NOT EXISTS idx_system_logs_timestamp ON system_logs(timestamp DESC)",
+]
+
+# Postgres INCLUDE payloads: the attendance lists read only these columns
+# (Attendance.select_rows), so they are served by index-only scans
+INCLUDE_COLUMNS = {
+    'idx_attendance_ts_cov': 'id, person_id, user_id, name, confidence',
+    'idx_attendance_user_ts_cov': 'id, person_id, name, confidence',
+}
+
+# Indexes superseded by the ones above (dropped after those are built)
+DROP_STATEMENTS = [
+    "DROP INDEX IF EXISTS idx_attendance_timestamp",
+    "DROP INDEX IF EXISTS ix_attendance_timestamp",
+    "DROP INDEX IF EXISTS idx_attendance_user_ts",
+    "DROP INDEX IF EXISTS idx_attendance_date",
+    "DROP INDEX IF EXISTS idx_enrollment_requests_user_id",
+    # Prefix of idx_attendance_name_timestamp
+    "DROP INDEX IF EXISTS ix_attendance_name",
+    # Unused by any query; every log insert paid for them
+    "DROP INDEX IF EXISTS idx_system_logs_user_type",
+    "DROP INDEX IF EXISTS idx_system_logs_action",
+    # Same column as idx_system_logs_timestamp
+    "DROP INDEX IF EXISTS ix_system_logs_timestamp",
+]
+
+INDEX_DDL = ";\n".join(INDEX_STATEMENTS + DROP_STATEMENTS) + ";"
+
+# Refresh planner statistics for the tables whose indexes changed shape
+ANALYZE_STATEMENTS = [
+    "ANALYZE attendance",
+    "ANALYZE signup_requests",
+    "ANALYZE enrollment_requests",
+]
+
 def add_indexes():
     """Add database indexes for performance optimization"""
     with app.app_context():
@@ -10,86 +82,36 @@ def add_indexes():
         try:
             print("Adding database indexes...")
             
-            # User indexes
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_users_status ON users(status)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_users_department ON users(department)"
-            ))
-            
-            # Person indexes
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_persons_user_id ON persons(user_id)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_persons_status ON persons(status)"
-            ))
-            
-            # SignupRequest indexes
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_signup_requests_status ON signup_requests(status)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_signup_requests_email ON signup_requests(email)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_signup_requests_submitted_at ON signup_requests(submitted_at)"
-            ))
-            
-            # EnrollmentRequest indexes
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_enrollment_requests_user_id ON enrollment_requests(user_id)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_enrollment_requests_status ON enrollment_requests(status)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_enrollment_requests_submitted_at ON enrollment_requests(submitted_at)"
-            ))
-            
-            # LeaveRequest indexes
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_leave_requests_user_id ON leave_requests(user_id)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_leave_requests_status ON leave_requests(status)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_leave_requests_start_date ON leave_requests(start_date)"
-            ))
-            
-            # Attendance indexes  
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_attendance_person_id ON attendance(person_id)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_attendance_user_id ON attendance(user_id)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_attendance_timestamp ON attendance(timestamp)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_attendance_date ON attendance(DATE(timestamp))"
-            ))
-            
-            # SystemLog indexes
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_system_logs_user_type ON system_logs(user_type)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_system_logs_action ON system_logs(action)"
-            ))
-            connection.execute(db.text(
-                "CREATE INDEX IF NOT EXISTS idx_system_logs_timestamp ON system_logs(timestamp)"
-            ))
+            dialect = db.engine.dialect.name
+            if dialect == 'sqlite':
+                # sqlite3 only runs multi-statement strings through executescript
+                connection.connection.executescript(INDEX_DDL)
+            elif dialect == 'postgresql':
+                # CONCURRENTLY doesn't block writes to the table, but it can't run in a
+                # transaction or a multi-statement script, so each index is its own call
+                connection.execution_options(isolation_level='AUTOCOMMIT')
+                for statement in INDEX_STATEMENTS:
+                    name = statement.split()[5]
+                    if name in INCLUDE_COLUMNS:
+                        statement += f" INCLUDE ({INCLUDE_COLUMNS[name]})"
+                    connection.exec_driver_sql(
+                        statement.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+                    )
+                for statement in DROP_STATEMENTS:
+                    connection.exec_driver_sql(
+                        statement.replace('DROP INDEX', 'DROP INDEX CONCURRENTLY', 1)
+                    )
+            else:
+                with connection.begin():
+                    for statement in INDEX_STATEMENTS + DROP_STATEMENTS:
+                        connection.exec_driver_sql(statement)
             
+            for statement in ANALYZE_STATEMENTS:
+                connection.exec_driver_sql(statement)
             connection.commit()
-            print("✓ Database indexes added successfully!")
             
+            print("✓ Database indexes added successfully!")
+        
         except Exception as e:
             print(f"Error adding indexes: {e}")
             connection.rollback()
@@ -4,40 +4,205 @@ Fast similarity search for duplicate checking before enrollment
 """
 import numpy as np
 import faiss
-import pickle
 import os
+import json
+import time
+import atexit
+import sqlite3
 import logging
+import threading
+from contextlib import contextmanager
 from typing import List, Tuple, Optional
 
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process file locking
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
+# Exact flat search is fine for small galleries. IVF-PQ only pays off once there
+# are enough vectors to train ~4*sqrt(N) coarse centroids (~39 points each)
+IVFPQ_MIN_VECTORS = 25000
+PQ_SUBQUANTIZERS = 32  # 32 bytes per stored vector with 8-bit codes
+DEFAULT_NPROBE = 8
+
+# Between the two, vectors are stored as 8-bit scalar codes: a quarter of the
+# memory traffic of float32 for well under 1% recall loss on face embeddings.
+# The per-dimension ranges are trained on up to SQ8_TRAIN_SAMPLE vectors. The
+# faiss-cpu wheel picks its AVX2 kernels automatically (FAISS_OPT_LEVEL overrides)
+SQ8_MIN_VECTORS = 2000
+SQ8_TRAIN_SAMPLE = 10000
+
+# Persist at most this often (or every FLUSH_EVERY adds) instead of on every insert
+FLUSH_INTERVAL_SECONDS = 5.0
+FLUSH_EVERY = 64
+
+# Optional fast reject: 64 random-hyperplane bits per embedding, split into 4-bit
+# bands. A query that shares no band with any enrolled face is answered without
+# touching the index. Exact signature matching would drop near-duplicates whose
+# bits differ anywhere, so banding keeps recall (>99% at cosine 0.6); the
+# tradeoff is that a large gallery covers most bands and the filter stops firing
+LSH_BITS = 64
+LSH_BAND_BITS = 4
+LSH_SEED = 1234
+
+# How often a read-only (mmapped) checker looks for an index rewritten by another process
+RELOAD_CHECK_SECONDS = 5.0
+
+def _as_faiss(x: np.ndarray) -> np.ndarray:
+    """float32 C-contiguous view of x, copying only when the layout requires it"""
+    x = np.asarray(x)
+    if x.dtype == np.float32 and x.flags.c_contiguous:
+        return x
+    return np.ascontiguousarray(x, dtype=np.float32)
+
+
+def _normalized(x: np.ndarray) -> np.ndarray:
+    """
+    L2-normalized float32 copy of x
+    normalize_L2 works in place, so the caller's array always needs one copy;
+    this makes exactly one whatever the input dtype/layout
+    """
+    out = np.array(x, dtype=np.float32, order='C', copy=True)
+    faiss.normalize_L2(out)
+    return out
+
+
 class DuplicateChecker:
     """Fast duplicate detection using FAISS ANN search"""
     
-    def __init__(self, index_path='faiss_index', dimension=512):
+    def __init__(self, index_path='faiss_index', dimension=512, nprobe=DEFAULT_NPROBE,
+                 lsh_prefilter=False):
         self.index_path = index_path
         self.dimension = dimension
-        self.index = None
-        self.person_ids = []  # Maps index positions to person IDs
-        self.metadata = {}  # person_id -> {name, email, etc.}
+        self.nprobe = nprobe  # IVF lists probed per query (speed/recall tradeoff)
+        self.lsh_prefilter = lsh_prefilter
+        self.index = None  # Stores person IDs itself (IDMap2 / IVF), search returns them
         
         os.makedirs(index_path, exist_ok=True)
         self.index_file = os.path.join(index_path, 'face_index.faiss')
-        self.metadata_file = os.path.join(index_path, 'metadata.pkl')
+        self.metadata_file = os.path.join(index_path, 'metadata.db')
+        self.lock_file = os.path.join(index_path, '.lock')
+        
+        # Loaded indexes are mmapped read-only so forked workers share one copy of
+        # the pages; the first write swaps in a private mutable copy
+        self._read_only = False
+        self._loaded_mtime = None
+        self._last_reload_check = time.monotonic()
+        
+        # person_id -> {name, email, etc.}, keyed lookups instead of a pickled dict
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(self.metadata_file, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS faiss_metadata (person_id INTEGER PRIMARY KEY, blob BLOB)"
+        )
+        self._db.commit()
+        # Decoded rows by person_id, so repeat hits skip SQLite and json entirely
+        self._metadata_cache = {}
+        
+        # LSH band keys of enrolled faces, persisted next to the metadata
+        self._lsh_planes = None
+        self._lsh_keys = set()
+        if lsh_prefilter:
+            self._lsh_planes = np.random.default_rng(LSH_SEED).standard_normal(
+                (dimension, LSH_BITS)).astype(np.float32)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lsh_bands (band_key INTEGER, person_id INTEGER)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_lsh_bands_person ON lsh_bands(person_id)")
+            self._db.commit()
+            self._load_lsh_keys()
+        
+        self._dirty = False
+        self._pending_writes = 0
+        self._last_flush = time.monotonic()
         
         self._load_or_create_index()
+        atexit.register(self.flush)
+    
+    def _set_metadata(self, items):
+        """Upsert (person_id, metadata) pairs; committed on flush"""
+        rows = [(int(pid), json.dumps(meta, default=str)) for pid, meta in items if meta]
+        if rows:
+            with self._db_lock:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO faiss_metadata (person_id, blob) VALUES (?, ?)", rows
+                )
+            for pid, _ in rows:
+                self._metadata_cache.pop(pid, None)
+    
+    def _get_metadata(self, person_ids) -> dict:
+        """Fetch metadata for the given person IDs, querying only uncached ones"""
+        cache = self._metadata_cache
+        missing = [int(pid) for pid in person_ids if pid not in cache]
+        if missing:
+            placeholders = ','.join('?' * len(missing))
+            with self._db_lock:
+                rows = self._db.execute(
+                    f"SELECT person_id, blob FROM faiss_metadata WHERE person_id IN ({placeholders})",
+                    missing
+                ).fetchall()
+            for pid, blob in rows:
+                cache[pid] = json.loads(blob)
+        return {pid: cache[pid] for pid in person_ids if pid in cache}
+    
+    def _band_keys(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, bands) int64 keys: band number in the high bits, band value in the low"""
+        bits = (vectors @ self._lsh_planes > 0).astype(np.int64)
+        n_bands = LSH_BITS // LSH_BAND_BITS
+        bits = bits.reshape(len(vectors), n_bands, LSH_BAND_BITS)
+        values = bits @ (1 << np.arange(LSH_BAND_BITS, dtype=np.int64))
+        return (np.arange(n_bands, dtype=np.int64) << LSH_BAND_BITS) | values
+    
+    def _add_lsh_keys(self, person_ids, vectors: np.ndarray):
+        """Record band keys for newly indexed vectors"""
+        keys = self._band_keys(vectors)
+        rows = [(key, int(pid)) for pid, row in zip(person_ids, keys.tolist()) for key in row]
+        with self._db_lock:
+            self._db.executemany("INSERT INTO lsh_bands (band_key, person_id) VALUES (?, ?)", rows)
+        self._lsh_keys.update(keys.ravel().tolist())
+    
+    def _load_lsh_keys(self):
+        """Rebuild the in-memory key set from the persisted bands"""
+        with self._db_lock:
+            rows = self._db.execute("SELECT DISTINCT band_key FROM lsh_bands").fetchall()
+        self._lsh_keys = {key for key, in rows}
+    
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """Serialize index file writes against other processes' reads"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_file, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
     
     def _load_or_create_index(self):
         """Load existing index or create new one"""
         try:
-            if os.path.exists(self.index_file) and os.path.exists(self.metadata_file):
-                # Load existing index
-                self.index = faiss.read_index(self.index_file)
-                with open(self.metadata_file, 'rb') as f:
-                    data = pickle.load(f)
-                    self.person_ids = data.get('person_ids', [])
-                    self.metadata = data.get('metadata', {})
-                logger.info(f"Loaded FAISS index with {len(self.person_ids)} entries")
+            if os.path.exists(self.index_file):
+                # Load existing index (zero-copy, shared through the page cache)
+                with self._file_lock(exclusive=False):
+                    self.index = faiss.read_index(self.index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                    self._loaded_mtime = os.path.getmtime(self.index_file)
+                if self.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                    # Indexes from the old L2 layout score differently; start over
+                    logger.warning("FAISS index uses L2 distance, rebuild required. Creating new index.")
+                    self._create_new_index()
+                    return
+                if not isinstance(self.index, (faiss.IndexIDMap2, faiss.IndexIVF)):
+                    # Older layout kept person IDs in a side file
+                    logger.warning("FAISS index has no person IDs, rebuild required. Creating new index.")
+                    self._create_new_index()
+                    return
+                self._read_only = True
+                self._apply_nprobe()
+                logger.info(f"Loaded FAISS index with {self.index.ntotal} entries")
             else:
                 # Create new index
                 self._create_new_index()
@@ -45,13 +210,67 @@ class DuplicateChecker:
             logger.error(f"Error loading index: {e}. Creating new index.")
             self._create_new_index()
     
-    def _create_new_index(self):
-        """Create a new FAISS index"""
-        # Use L2 distance (Euclidean) for face embeddings
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.person_ids = []
-        self.metadata = {}
-        logger.info("Created new FAISS index")
+    def _ensure_writable(self):
+        """Swap the shared read-only mapping for a private mutable copy"""
+        if not self._read_only:
+            return
+        
+        with self._file_lock(exclusive=False):
+            self.index = faiss.read_index(self.index_file)
+        
+        self._read_only = False
+        self._apply_nprobe()
+    
+    def _maybe_reload(self):
+        """Pick up an index rewritten by another process (read-only instances only)"""
+        now = time.monotonic()
+        if not self._read_only or now - self._last_reload_check < RELOAD_CHECK_SECONDS:
+            return
+        self._last_reload_check = now
+        
+        try:
+            if os.path.getmtime(self.index_file) != self._loaded_mtime:
+                self._load_or_create_index()
+                self._metadata_cache = {}  # the writer may have changed rows too
+                if self.lsh_prefilter:
+                    self._load_lsh_keys()
+        except OSError:
+            pass
+    
+    def _create_new_index(self, train_vectors: np.ndarray = None):
+        """
+        Create a new FAISS index
+        With enough training vectors this is IVF-PQ (sub-linear search over
+        compressed codes), then an 8-bit scalar-quantized flat index, and for
+        small galleries an exact float32 flat index; the flat ones are wrapped
+        in IDMap2. All store person IDs and support remove_ids. IVF is not
+        wrapped: it keeps its own IDs, and IDMap's compaction assumes a flat index.
+        """
+        n_vectors = 0 if train_vectors is None else len(train_vectors)
+        
+        # Inner product on L2-normalized embeddings: the score is cosine similarity
+        if n_vectors >= IVFPQ_MIN_VECTORS:
+            nlist = max(64, int(4 * np.sqrt(n_vectors)))
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            self.index = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, PQ_SUBQUANTIZERS, 8,
+                                          faiss.METRIC_INNER_PRODUCT)
+            self.index.train(train_vectors)
+            self._apply_nprobe()
+        elif n_vectors >= SQ8_MIN_VECTORS:
+            sq = faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_8bit,
+                                            faiss.METRIC_INNER_PRODUCT)
+            sq.train(train_vectors[:SQ8_TRAIN_SAMPLE])
+            self.index = faiss.IndexIDMap2(sq)
+        else:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+        
+        self._read_only = False
+        logger.info(f"Created new FAISS index ({type(self.index).__name__})")
+    
+    def _apply_nprobe(self):
+        """Set the number of probed lists on IVF indexes"""
+        if isinstance(self.index, faiss.IndexIVF):
+            self.index.nprobe = self.nprobe
     
     def add_embedding(self, person_id: int, embedding: np.ndarray, metadata: dict = None):
         """
@@ -71,17 +290,19 @@ class DuplicateChecker:
                 return False
             
             # Add to index
-            self.index.add(embedding.astype('float32'))
-            self.person_ids.append(person_id)
+            self._ensure_writable()
+            embedding = _normalized(embedding)
+            self.index.add_with_ids(embedding, np.full(len(embedding), person_id, dtype=np.int64))
+            if self.lsh_prefilter:
+                self._add_lsh_keys([person_id] * len(embedding), embedding)
             
             # Store metadata
-            if metadata:
-                self.metadata[person_id] = metadata
+            self._set_metadata([(person_id, metadata)])
             
-            # Save index
-            self._save_index()
+            # Save index (batched)
+            self._mark_dirty()
             
-            logger.info(f"Added embedding for person {person_id}. Total entries: {len(self.person_ids)}")
+            logger.info(f"Added embedding for person {person_id}. Total entries: {self.index.ntotal}")
             return True
         
         except Exception as e:
@@ -94,51 +315,84 @@ class DuplicateChecker:
         Args:
             embedding: Query face embedding
             k: Number of top matches to return
-            threshold: Similarity threshold (0-1, higher = more similar)
+            threshold: Cosine similarity threshold (higher = more similar)
+        Returns:
+            List of dicts with person_id, distance (1 - cosine), similarity, metadata
+        """
+        if embedding.ndim == 1:
+            embedding = embedding.reshape(1, -1)
+        results = self.find_duplicates_batch(embedding[:1], k=k, threshold=threshold)
+        return results[0] if results else []
+    
+    def find_duplicates_batch(self, embeddings: np.ndarray, k: int = 5, threshold: float = 0.6) -> List[List[dict]]:
+        """
+        Find potential duplicates for many candidates with one ANN search
+        FAISS spreads a multi-row query over its OpenMP threads, so B candidates
+        cost one search call instead of B
+        Args:
+            embeddings: (B, dimension) query face embeddings
+            k: Number of top matches to return per query
+            threshold: Cosine similarity threshold (higher = more similar)
         Returns:
-            List of dicts with person_id, distance, similarity, metadata
+            One list of matches (as in find_duplicates) per query row
         """
         try:
-            if len(self.person_ids) == 0:
-                return []
+            self._maybe_reload()
+            index = self.index  # one snapshot, in case a reload swaps it mid-call
+            ntotal = index.ntotal
             
-            # Ensure embedding is the right shape
-            if embedding.ndim == 1:
-                embedding = embedding.reshape(1, -1)
+            # Ensure embeddings are the right shape
+            if embeddings.ndim == 1:
+                embeddings = embeddings.reshape(1, -1)
             
-            if embedding.shape[1] != self.dimension:
+            if embeddings.shape[1] != self.dimension:
                 logger.error(f"Embedding dimension mismatch")
                 return []
             
+            batch_results = [[] for _ in range(len(embeddings))]
+            if ntotal == 0 or len(embeddings) == 0:
+                return batch_results
+            
+            embeddings = _normalized(embeddings)
+            rows = np.arange(len(embeddings))
+            if self.lsh_prefilter:
+                # Only search queries that share a band with some enrolled face
+                keys = self._band_keys(embeddings).tolist()
+                rows = np.flatnonzero([not self._lsh_keys.isdisjoint(row) for row in keys])
+                if len(rows) == 0:
+                    return batch_results
+                embeddings = embeddings[rows]
+            
             # Search for top k nearest neighbors
-            k = min(k, len(self.person_ids))  # Don't search for more than available
-            distances, indices = self.index.search(embedding.astype('float32'), k)
-            
-            # Convert distances to similarities (1 / (1 + distance))
-            # Lower distance = higher similarity
-            results = []
-            for dist, idx in zip(distances[0], indices[0]):
-                if idx < len(self.person_ids):
-                    person_id = self.person_ids[idx]
-                    # Normalize distance to similarity score (0-1)
-                    # Using inverse distance: similarity = 1 / (1 + distance)
-                    similarity = 1.0 / (1.0 + float(dist))
-                    
-                    if similarity >= threshold:
-                        result = {
-                            'person_id': person_id,
-                            'distance': float(dist),
-                            'similarity': round(similarity, 4),
-                            'confidence': round(similarity * 100, 2),
-                            'metadata': self.metadata.get(person_id, {}),
-                            'is_high_match': similarity >= 0.85
-                        }
-                        results.append(result)
-            
-            # Sort by similarity (highest first)
-            results.sort(key=lambda x: x['similarity'], reverse=True)
-            
-            return results
+            k = k if k < ntotal else ntotal  # Don't search for more than available
+            scores, person_ids = index.search(embeddings, k)
+            
+            # Scores are already cosine similarities; filter and order each row in NumPy
+            scores[(scores < threshold) | (person_ids < 0)] = -np.inf
+            order = np.argsort(-scores, axis=1, kind='stable')
+            scores = np.take_along_axis(scores, order, axis=1)
+            person_ids = np.take_along_axis(person_ids, order, axis=1)
+            keep = np.isfinite(scores)
+            
+            # One metadata query for every hit in the batch
+            metadata = self._get_metadata(np.unique(person_ids[keep]).tolist())
+            
+            for row, row_scores, row_ids, row_keep in zip(rows.tolist(), scores, person_ids, keep):
+                results = []
+                for person_id, similarity in zip(row_ids[row_keep].tolist(),
+                                                 row_scores[row_keep].astype(np.float64).tolist()):
+                    result = {
+                        'person_id': person_id,
+                        'distance': round(1.0 - similarity, 4),
+                        'similarity': round(similarity, 4),
+                        'confidence': round(similarity * 100, 2),
+                        'metadata': metadata.get(person_id, {}),
+                        'is_high_match': similarity >= 0.85
+                    }
+                    results.append(result)
+                batch_results[row] = results
+            
+            return batch_results
         
         except Exception as e:
             logger.error(f"Error finding duplicates: {e}")
@@ -146,25 +400,24 @@ class DuplicateChecker:
     
     def remove_person(self, person_id: int):
         """
-        Remove a person from the index
-        Note: FAISS doesn't support deletion, so we rebuild the index
+        Remove all of a person's embeddings from the index
         """
         try:
-            if person_id not in self.person_ids:
+            self._ensure_writable()
+            removed = self.index.remove_ids(np.array([person_id], dtype=np.int64))
+            if removed == 0:
                 return False
             
-            # Get all embeddings except the one to remove
-            all_embeddings = []
-            new_person_ids = []
-            new_metadata = {}
+            with self._db_lock:
+                self._db.execute("DELETE FROM faiss_metadata WHERE person_id = ?", (int(person_id),))
+                if self.lsh_prefilter:
+                    self._db.execute("DELETE FROM lsh_bands WHERE person_id = ?", (int(person_id),))
+            self._metadata_cache.pop(int(person_id), None)
+            if self.lsh_prefilter:
+                self._load_lsh_keys()
             
-            # This requires storing embeddings separately or rebuilding from DB
-            # For now, we'll just mark in metadata
-            if person_id in self.metadata:
-                self.metadata[person_id]['deleted'] = True
-            
-            logger.info(f"Marked person {person_id} as deleted")
-            self._save_index()
+            logger.info(f"Removed {removed} embeddings for person {person_id}")
+            self._mark_dirty()
             return True
         
         except Exception as e:
@@ -178,50 +431,99 @@ class DuplicateChecker:
             embeddings_data: List of (person_id, embedding, metadata) tuples
         """
         try:
-            self._create_new_index()
+            vectors = np.vstack([
+                _as_faiss(embedding).reshape(1, -1)
+                for _, embedding, _ in embeddings_data
+            ]) if embeddings_data else np.empty((0, self.dimension), dtype='float32')
+            faiss.normalize_L2(vectors)
             
-            for person_id, embedding, metadata in embeddings_data:
-                if embedding.ndim == 1:
-                    embedding = embedding.reshape(1, -1)
-                
-                self.index.add(embedding.astype('float32'))
-                self.person_ids.append(person_id)
-                if metadata:
-                    self.metadata[person_id] = metadata
+            # Trains IVF-PQ on the full gallery when it is large enough
+            self._create_new_index(vectors)
+            with self._db_lock:
+                self._db.execute("DELETE FROM faiss_metadata")
+                if self.lsh_prefilter:
+                    self._db.execute("DELETE FROM lsh_bands")
+            self._metadata_cache = {}
+            self._lsh_keys = set()
+            
+            if len(vectors):
+                ids = np.array([person_id for person_id, _, _ in embeddings_data], dtype=np.int64)
+                self.index.add_with_ids(vectors, ids)
+                if self.lsh_prefilter:
+                    self._add_lsh_keys(ids.tolist(), vectors)
+            self._set_metadata((person_id, metadata) for person_id, _, metadata in embeddings_data)
             
             self._save_index()
-            logger.info(f"Rebuilt index with {len(self.person_ids)} entries")
+            logger.info(f"Rebuilt index with {self.index.ntotal} entries")
             return True
         
         except Exception as e:
             logger.error(f"Error rebuilding index: {e}")
             return False
     
+    def _mark_dirty(self):
+        """Record an unsaved change and flush if the batch is due"""
+        self._dirty = True
+        self._pending_writes += 1
+        
+        if (self._pending_writes >= FLUSH_EVERY or
+                time.monotonic() - self._last_flush > FLUSH_INTERVAL_SECONDS):
+            self.flush()
+    
+    def flush(self):
+        """Write pending changes to disk (also runs at interpreter exit)"""
+        if self._dirty:
+            self._save_index()
+    
     def _save_index(self):
         """Save index and metadata to disk"""
         try:
-            faiss.write_index(self.index, self.index_file)
+            if not self._read_only:
+                # Write aside and rename so readers never map a partial file;
+                # its mtime tells other processes to reload
+                with self._file_lock(exclusive=True):
+                    faiss.write_index(self.index, self.index_file + '.tmp')
+                    os.replace(self.index_file + '.tmp', self.index_file)
+                    self._loaded_mtime = os.path.getmtime(self.index_file)
             
-            with open(self.metadata_file, 'wb') as f:
-                pickle.dump({
-                    'person_ids': self.person_ids,
-                    'metadata': self.metadata
-                }, f)
+            with self._db_lock:
+                self._db.commit()
             
+            self._dirty = False
+            self._pending_writes = 0
+            self._last_flush = time.monotonic()
             logger.debug("Index saved successfully")
         
         except Exception as e:
             logger.error(f"Error saving index: {e}")
     
+    def _metadata_count(self) -> int:
+        with self._db_lock:
+            return self._db.execute("SELECT COUNT(*) FROM faiss_metadata").fetchone()[0]
+    
     def get_stats(self) -> dict:
         """Get index statistics"""
         return {
-            'total_entries': len(self.person_ids),
+            'total_entries': self.index.ntotal,
             'dimension': self.dimension,
-            'index_type': 'IndexFlatL2',
-            'metadata_count': len(self.metadata)
+            'index_type': type(self.index).__name__,
+            'metadata_count': self._metadata_count()
         }
 
 
-# Global duplicate checker instance
-duplicate_checker = DuplicateChecker()
+# Global duplicate checker instance, created on first use so workers that never
+# check duplicates don't load the index
+_duplicate_checker = None
+_duplicate_checker_lock = threading.Lock()
+
+def get_duplicate_checker() -> DuplicateChecker:
+    """Return the shared DuplicateChecker, loading the index on first call"""
+    global _duplicate_checker
+    if _duplicate_checker is None:
+        with _duplicate_checker_lock:
+            if _duplicate_checker is None:
+                # LSH pre-filtering is opt-in: it trades a little recall for speed
+                _duplicate_checker = DuplicateChecker(
+                    lsh_prefilter=os.getenv('DUPLICATE_LSH_PREFILTER', '0') == '1'
+                )
+    return _duplicate_checker
@@ -1,8 +1,94 @@
 import os
-import random
-import string
+import smtplib
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 from flask import current_app
+from jinja2 import Environment
+from secrets import randbelow
+
+VERIFY_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }
+        .content { background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px; }
+        .code-box { background: white; border: 2px dashed #667eea; padding: 20px; text-align: center; margin: 20px 0; border-radius: 8px; }
+        .code { font-size: 32px; font-weight: bold; letter-spacing: 8px; color: #667eea; }
+        .footer { text-align: center; margin-top: 20px; color: #666; font-size: 14px; }
+        .button { display: inline-block; background: #667eea; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin: 20px 0; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>Email Verification</h1>
+        </div>
+        <div class="content">
+            <p>Hello {{ user_name }},</p>
+            <p>Thank you for joining Smart Attendance System! Your signup request has been approved by the administrator.</p>
+            <p>Please verify your email address using the verification code below:</p>
+
+            <div class="code-box">
+                <div class="code">{{ code }}</div>
+            </div>
+
+            <p>This code will expire in 24 hours.</p>
+            <p>If you didn't request this verification, please ignore this email.</p>
+
+            <div class="footer">
+                <p>&copy; 2024 Smart Attendance System. All rights reserved.</p>
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+APPROVAL_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <style>
+        body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+        .container { max-width: 600px; margin: 0 auto; padding: 20px; }
+        .header { background: linear-gradient(135deg, #10b981 0%, #059669 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }
+        .content { background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px; }
+        .button { display: inline-block; background: #10b981; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin: 20px 0; }
+        .footer { text-align: center; margin-top: 20px; color: #666; font-size: 14px; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>✓ Account Approved!</h1>
+        </div>
+        <div class="content">
+            <p>Hello {{ user_name }},</p>
+            <p>Great news! Your account has been approved by the administrator.</p>
+            <p>You can now log in to the Smart Attendance System and start using all features.</p>
+
+            <div style="text-align: center;">
+                <a href="{{ app_url }}/login" class="button">Login Now</a>
+            </div>
+
+            <div class="footer">
+                <p>&copy; 2024 Smart Attendance System. All rights reserved.</p>
+            </div>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+# Compiled once; autoescape keeps user-supplied names from injecting HTML
+_template_env = Environment(autoescape=True)
+_VERIFY_TPL = _template_env.from_string(VERIFY_HTML)
+_APPROVAL_TPL = _template_env.from_string(APPROVAL_HTML)
 
 class EmailService:
     """Email service for sending verification codes and notifications"""
@@ -15,10 +101,47 @@ class EmailService:
         self.smtp_password = os.getenv('SMTP_PASSWORD', '')
         self.from_email = os.getenv('FROM_EMAIL', 'noreply@smartattendance.com')
         self.from_name = os.getenv('FROM_NAME', 'Smart Attendance System')
+        self.app_url = os.getenv('APP_URL', 'http://localhost:5000')
+        
+        # One SMTP session per thread, reused across emails
+        self._conn_local = threading.local()
+    
+    def _get_smtp(self):
+        """Return this thread's SMTP session, connecting and logging in on first use"""
+        server = getattr(self._conn_local, 'server', None)
+        if server is None:
+            server = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=30)
+            try:
+                server.starttls()
+                if self.smtp_user and self.smtp_password:
+                    server.login(self.smtp_user, self.smtp_password)
+            except Exception:
+                # Don't leak the socket when the handshake or login fails
+                server.close()
+                raise
+            self._conn_local.server = server
+        return server
+    
+    def _close_smtp(self):
+        server = getattr(self._conn_local, 'server', None)
+        self._conn_local.server = None
+        if server is not None:
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+    
+    def _send_message(self, message):
+        """Send over the cached session; reconnect once if the server dropped it"""
+        try:
+            self._get_smtp().send_message(message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self._close_smtp()
+            self._get_smtp().send_message(message)
     
     def generate_verification_code(self, length=6):
-        """Generate a random verification code"""
-        return ''.join(random.choices(string.digits, k=length))
+        """Generate a random verification code (CSPRNG, zero-padded)"""
+        return f"{randbelow(10 ** length):0{length}d}"
     
     def send_verification_code(self, to_email, code, user_name):
         """Send verification code to user's email"""
@@ -27,52 +150,9 @@ class EmailService:
             return True
         
         try:
-            import smtplib
-            from email.mime.text import MIMEText
-            from email.mime.multipart import MIMEMultipart
-            
             subject = 'Verify Your Email - Smart Attendance System'
             
-            html_body = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                    .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                    .header {{ background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
-                    .content {{ background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px; }}
-                    .code-box {{ background: white; border: 2px dashed #667eea; padding: 20px; text-align: center; margin: 20px 0; border-radius: 8px; }}
-                    .code {{ font-size: 32px; font-weight: bold; letter-spacing: 8px; color: #667eea; }}
-                    .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 14px; }}
-                    .button {{ display: inline-block; background: #667eea; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin: 20px 0; }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="header">
-                        <h1>Email Verification</h1>
-                    </div>
-                    <div class="content">
-                        <p>Hello {user_name},</p>
-                        <p>Thank you for joining Smart Attendance System! Your signup request has been approved by the administrator.</p>
-                        <p>Please verify your email address using the verification code below:</p>
-                        
-                        <div class="code-box">
-                            <div class="code">{code}</div>
-                        </div>
-                        
-                        <p>This code will expire in 24 hours.</p>
-                        <p>If you didn't request this verification, please ignore this email.</p>
-                        
-                        <div class="footer">
-                            <p>&copy; 2024 Smart Attendance System. All rights reserved.</p>
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
+            html_body = _VERIFY_TPL.render(code=code, user_name=user_name)
             
             message = MIMEMultipart('alternative')
             message['Subject'] = subject
@@ -82,11 +162,7 @@ class EmailService:
             html_part = MIMEText(html_body, 'html')
             message.attach(html_part)
             
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                server.starttls()
-                if self.smtp_user and self.smtp_password:
-                    server.login(self.smtp_user, self.smtp_password)
-                server.send_message(message)
+            self._send_message(message)
             
             current_app.logger.info(f'Verification email sent to {to_email}')
             return True
@@ -102,47 +178,12 @@ class EmailService:
             return True
         
         try:
-            import smtplib
-            from email.mime.text import MIMEText
-            from email.mime.multipart import MIMEMultipart
-            
             subject = 'Account Approved - Smart Attendance System'
             
-            html_body = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <style>
-                    body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                    .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                    .header {{ background: linear-gradient(135deg, #10b981 0%, #059669 100%); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
-                    .content {{ background: #f9f9f9; padding: 30px; border-radius: 0 0 10px 10px; }}
-                    .button {{ display: inline-block; background: #10b981; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; margin: 20px 0; }}
-                    .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 14px; }}
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="header">
-                        <h1>✓ Account Approved!</h1>
-                    </div>
-                    <div class="content">
-                        <p>Hello {user_name},</p>
-                        <p>Great news! Your account has been approved by the administrator.</p>
-                        <p>You can now log in to the Smart Attendance System and start using all features.</p>
-                        
-                        <div style="text-align: center;">
-                            <a href="{os.getenv('APP_URL', 'http://localhost:5000')}/login" class="button">Login Now</a>
-                        </div>
-                        
-                        <div class="footer">
-                            <p>&copy; 2024 Smart Attendance System. All rights reserved.</p>
-                        </div>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
+            html_body = _APPROVAL_TPL.render(
+                user_name=user_name,
+                app_url=self.app_url
+            )
             
             message = MIMEMultipart('alternative')
             message['Subject'] = subject
@@ -152,11 +193,7 @@ class EmailService:
             html_part = MIMEText(html_body, 'html')
             message.attach(html_part)
             
-            with smtplib.SMTP(self.smtp_host, self.smtp_port) as server:
-                server.starttls()
-                if self.smtp_user and self.smtp_password:
-                    server.login(self.smtp_user, self.smtp_password)
-                server.send_message(message)
+            self._send_message(message)
             
             current_app.logger.info(f'Approval notification sent to {to_email}')
             return True
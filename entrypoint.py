@@ -5,18 +5,27 @@ Handles PORT environment variable properly
 """
 import os
 import sys
-import subprocess
+
+from config import GUNICORN_THREADS
 
 # Get PORT from environment, default to 5000
 port = os.environ.get('PORT', '5000')
 
-print(f"Starting application on port {port}")
+# Classic gunicorn sizing (2 x CPU + 1); WEB_CONCURRENCY overrides
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+
+print(f"Starting application on port {port} with {workers} workers x {GUNICORN_THREADS} threads")
 
 # Start Gunicorn
+# gthread lets DB/SMTP/disk-bound requests overlap inside a worker; --preload
+# loads the app (and the FAISS index) before forking so workers share its pages
 cmd = [
     'gunicorn',
     '--bind', f'0.0.0.0:{port}',
-    '--workers', '2',
+    '--workers', str(workers),
+    '--worker-class', 'gthread',
+    '--threads', str(GUNICORN_THREADS),
+    '--preload',
     '--timeout', '120',
     '--access-logfile', '-',
     '--error-logfile', '-',
@@ -24,13 +33,11 @@ cmd = [
 ]
 
 print(f"Running command: {' '.join(cmd)}")
+sys.stdout.flush()  # exec discards unflushed output
 
-# Execute Gunicorn
+# Replace this process with Gunicorn so it receives signals directly
 try:
-    subprocess.run(cmd, check=True)
-except KeyboardInterrupt:
-    print("\nShutting down gracefully...")
-    sys.exit(0)
-except Exception as e:
+    os.execvp(cmd[0], cmd)
+except OSError as e:
     print(f"Error starting application: {e}")
     sys.exit(1)
@@ -4,13 +4,187 @@ import numpy as np
 import base64
 import pickle
 import faiss
+import time
+import atexit
+import threading
 from deepface import DeepFace
-from PIL import Image
-import io
+from deepface.commons import functions as deepface_functions
+from deepface.detectors import FaceDetector
 import logging
 
+try:
+    from numba import njit, prange
+except ImportError:  # Numba is optional, fall back to OpenCV/NumPy passes
+    njit = None
+
 logger = logging.getLogger(__name__)
 
+# Exact search is fine for small galleries; past this many embeddings the index
+# is rebuilt as IVF + 4-bit PQ FastScan (in-register SIMD lookup tables), with
+# the top candidates re-scored against 8-bit scalar-quantized copies (512 B per
+# face instead of 2 KB; cosine error ~1e-3, well inside the thresholds' margins)
+IVF_MIN_EMBEDDINGS = 2000
+IVF_MAX_NLIST = 256
+IVF_MIN_POINTS_PER_LIST = 39  # FAISS warns below this when training k-means
+IVF_NPROBE = 8
+REFINE_K_FACTOR = 4
+
+# Flat galleries at least this large are pre-filtered with sign-binarized codes
+# (64 bytes per face, Hamming distance via POPCNT); the best BINARY_CANDIDATES
+# are then scored exactly with float inner products
+BINARY_GATE_MIN = 1000
+BINARY_CANDIDATES = 32
+
+# Concurrent recognitions within this window share one index.search call; the
+# search threads over queries, so a batch reads the gallery once for all of them
+SEARCH_BATCH_WINDOW = 0.005
+
+# Below this many embeddings a compiled dot-product + top-k loop beats the FAISS
+# call overhead (when Numba is available)
+SMALL_GALLERY_MAX = 2048
+
+# Adds mark the index dirty; a background thread saves once per burst
+SAVE_DEBOUNCE_SECONDS = 2.0
+
+if njit is not None:
+    @njit(cache=True)
+    def _luma(img, y, x):
+        """8-bit luma of one pixel of an (h, w, 1) gray or (h, w, 3) BGR image
+        (BT.601 weights in fixed point, like cv2.COLOR_BGR2GRAY)"""
+        if img.shape[2] == 1:
+            return np.int64(img[y, x, 0])
+        return (29 * np.int64(img[y, x, 0]) + 150 * np.int64(img[y, x, 1])
+                + 77 * np.int64(img[y, x, 2]) + 128) >> 8
+    
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _face_quality_stats(img):
+        """Mean, standard deviation and Laplacian variance of a uint8 image.
+        
+        One traversal straight over the gray or BGR pixels, without building
+        a gray copy: each row adds its luma to the intensity sums and, for
+        interior rows, its 3x3 Laplacian responses to the Laplacian sums.
+        """
+        h, w = img.shape[0], img.shape[1]
+        px_sum = 0
+        px_sq_sum = 0
+        lap_sum = 0
+        lap_sq_sum = 0
+        for y in prange(h):
+            row_sum = 0
+            row_sq_sum = 0
+            for x in range(w):
+                v = _luma(img, y, x)
+                row_sum += v
+                row_sq_sum += v * v
+            row_lap_sum = 0
+            row_lap_sq_sum = 0
+            if 0 < y < h - 1:
+                for x in range(1, w - 1):
+                    v = (_luma(img, y - 1, x) + _luma(img, y + 1, x)
+                         + _luma(img, y, x - 1) + _luma(img, y, x + 1)
+                         - 4 * _luma(img, y, x))
+                    row_lap_sum += v
+                    row_lap_sq_sum += v * v
+            px_sum += row_sum
+            px_sq_sum += row_sq_sum
+            lap_sum += row_lap_sum
+            lap_sq_sum += row_lap_sq_sum
+        
+        n = h * w
+        mean = px_sum / n
+        std = np.sqrt(max(px_sq_sum / n - mean * mean, 0.0))
+        n_lap = (h - 2) * (w - 2)
+        lap_mean = lap_sum / n_lap
+        return mean, std, lap_sq_sum / n_lap - lap_mean * lap_mean
+else:
+    _face_quality_stats = None
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _topk_cosine(query, gallery, k):
+        """Top-k inner products of a normalized query against gallery rows.
+        
+        Scores every row in parallel (the 512-wide dot product vectorizes to
+        FMAs), then keeps the best k with an insertion sort.
+        """
+        n, d = gallery.shape
+        scores = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            acc = np.float32(0.0)
+            for j in range(d):
+                acc += gallery[i, j] * query[j]
+            scores[i] = acc
+        
+        top_scores = np.full(k, -np.inf, dtype=np.float32)
+        top_ids = np.full(k, -1, dtype=np.int64)
+        for i in range(n):
+            s = scores[i]
+            if s <= top_scores[k - 1]:
+                continue
+            pos = k - 1
+            while pos > 0 and top_scores[pos - 1] < s:
+                top_scores[pos] = top_scores[pos - 1]
+                top_ids[pos] = top_ids[pos - 1]
+                pos -= 1
+            top_scores[pos] = s
+            top_ids[pos] = i
+        return top_scores, top_ids
+else:
+    _topk_cosine = None
+
+
+class _SearchBatcher:
+    """Coalesce concurrent single-query searches into one batched search"""
+    
+    def __init__(self, window=SEARCH_BATCH_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = []
+        self._active = 0  # searches between entry and result, queued or running
+    
+    def search(self, index, query, k):
+        """Search one (1, d) query; the first caller in a window runs the batch"""
+        slot = {'query': query, 'k': k, 'event': threading.Event()}
+        with self._lock:
+            self._pending.append(slot)
+            self._active += 1
+            leader = len(self._pending) == 1
+            # A lone search runs at once; wait for company only under concurrent load
+            busy = self._active > 1
+        
+        try:
+            self._run(index, slot, leader, busy)
+        finally:
+            with self._lock:
+                self._active -= 1
+        
+        if 'error' in slot:
+            raise slot['error']
+        return slot['result']
+    
+    def _run(self, index, slot, leader, busy):
+        """Wait for the leader's batch, or (as leader) collect and run it"""
+        if not leader:
+            slot['event'].wait()
+        else:
+            if busy:
+                time.sleep(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            
+            try:
+                k_max = max(item['k'] for item in batch)
+                scores, indices = index.search(np.vstack([item['query'] for item in batch]), k_max)
+                for i, item in enumerate(batch):
+                    item['result'] = (scores[i:i + 1, :item['k']], indices[i:i + 1, :item['k']])
+            except Exception as e:
+                for item in batch:
+                    item['error'] = e
+            finally:
+                for item in batch:
+                    item['event'].set()
+
+
 class FaceService:
     """Enhanced face recognition service with strong anti-false-positive measures"""
     
@@ -21,39 +195,183 @@ class FaceService:
         # Very strict threshold for critical operations
         self.strict_threshold = 0.85
         self.index = None
-        self.person_ids = []
+        self.bin_index = None  # binary gating codes, kept beside flat indexes only
+        # Loaded indexes are mmapped read-only (pages shared between workers);
+        # the first add swaps in a private copy
+        self._read_only = False
+        self._gallery = None  # float32 copy of a small flat index for _topk_cosine
+        self._row_ids = None  # person id of each flat row, for the row-level searches
+        self._id_counts = {}  # person_id -> number of stored embeddings
+        self._batcher = _SearchBatcher()
+        # Guards index mutation against the background save
+        self._index_lock = threading.RLock()
+        self._dirty = threading.Event()
+        self._writer = None
         # Using Facenet512 for 512-dim embeddings (more accurate than 128-dim)
         self.embedding_dim = 512
         self.model_name = "Facenet512"
         # Use more accurate detector
         self.detector_backend = "retinaface"
+        self.model = None
+        self.detector = None
         
         os.makedirs(index_path, exist_ok=True)
+        self.log_faiss_build()
         self.load_index()
+        self.load_models()
+    
+    def log_faiss_build(self):
+        """
+        Log which FAISS SIMD build was loaded
+        The faiss-cpu wheel ships a generic and an AVX2 library and picks AVX2
+        on capable CPUs; FAISS_OPT_LEVEL=generic/avx2 overrides the choice.
+        AVX-512 kernels need a source build (-DFAISS_OPT_LEVEL=avx512)
+        """
+        options = faiss.get_compile_options()
+        if 'AVX2' in options or 'AVX512' in options:
+            logger.info(f"FAISS build: {options}")
+        else:
+            logger.warning(f"FAISS build has no AVX2 kernels ({options}); distance scans use generic code")
+    
+    def load_models(self):
+        """
+        Build the embedding model and face detector once per process
+        DeepFace keeps both in module-level caches that represent() reuses,
+        so this moves the weight loading and graph construction off the first request
+        """
+        try:
+            self.model = DeepFace.build_model(self.model_name)
+            self.detector = FaceDetector.build_model(self.detector_backend)
+            logger.info(f"Loaded {self.model_name} model and {self.detector_backend} detector")
+        except Exception as e:
+            # represent() will retry the load on first use
+            logger.warning(f"Could not preload face models: {e}")
     
     def load_index(self):
         """Load FAISS index from disk"""
         index_file = os.path.join(self.index_path, 'faiss.index')
         ids_file = os.path.join(self.index_path, 'person_ids.pkl')
         
-        if os.path.exists(index_file) and os.path.exists(ids_file):
+        if os.path.exists(index_file):
             try:
-                self.index = faiss.read_index(index_file)
-                with open(ids_file, 'rb') as f:
-                    self.person_ids = pickle.load(f)
-                logger.info(f"Loaded FAISS index with {len(self.person_ids)} persons")
+                index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._read_only = True
+                if not isinstance(index, faiss.IndexIDMap2):
+                    # Older layout: bare index plus a pickled row -> person id list
+                    with open(ids_file, 'rb') as f:
+                        index = self._with_person_ids(index, pickle.load(f))
+                    self._read_only = False
+                self.index = index
+                self._apply_search_params()
+                self._reset_side_structures()
+                logger.info(f"Loaded FAISS index with {len(self._id_counts)} persons")
             except Exception as e:
                 logger.error(f"Error loading FAISS index: {e}")
                 self.initialize_index()
         else:
             self.initialize_index()
     
-    def initialize_index(self):
+    def initialize_index(self, train_embeddings=None):
         """Initialize new FAISS index with Inner Product for normalized vectors"""
+        n = 0 if train_embeddings is None else len(train_embeddings)
+        
         # Use Inner Product index for normalized embeddings (cosine similarity)
-        self.index = faiss.IndexFlatIP(self.embedding_dim)
-        self.person_ids = []
-        logger.info("Initialized new FAISS index with Inner Product")
+        if n >= IVF_MIN_EMBEDDINGS:
+            nlist = min(IVF_MAX_NLIST, n // IVF_MIN_POINTS_PER_LIST)
+            base = faiss.index_factory(
+                self.embedding_dim, f"IVF{nlist},PQ64x4fs,Refine(SQ8)", faiss.METRIC_INNER_PRODUCT
+            )
+            base.train(train_embeddings)
+        else:
+            base = faiss.IndexFlatIP(self.embedding_dim)
+        # IDMap2 stores the person id of every vector, so search returns ids directly
+        self.index = faiss.IndexIDMap2(base)
+        self._apply_search_params()
+        self._read_only = False
+        self._reset_side_structures()
+        logger.info(f"Initialized new FAISS index with Inner Product ({type(base).__name__})")
+    
+    def _with_person_ids(self, base, person_ids):
+        """Re-add a bare index's vectors into an IDMap2 keyed by person id"""
+        vectors = base.reconstruct_n(0, base.ntotal)
+        empty = faiss.clone_index(base)  # keeps IVF training
+        empty.reset()
+        index = faiss.IndexIDMap2(empty)
+        index.add_with_ids(vectors, np.asarray(person_ids, dtype=np.int64))
+        return index
+    
+    def _base_index(self):
+        """The index wrapped by the IDMap2"""
+        return faiss.downcast_index(self.index.index)
+    
+    def _reset_side_structures(self):
+        """Recompute everything derived from the index contents"""
+        self._gallery = None
+        self._row_ids = None
+        ids, counts = np.unique(faiss.vector_to_array(self.index.id_map), return_counts=True)
+        self._id_counts = dict(zip(ids.tolist(), counts.tolist()))
+        self._build_binary_index()
+    
+    def _apply_search_params(self):
+        """Set nprobe and re-ranking depth on IVF indexes"""
+        base = self._base_index()
+        if isinstance(base, faiss.IndexRefine):
+            base.k_factor = REFINE_K_FACTOR
+            # try_extract_index_ivf doesn't look inside IndexRefine on faiss 1.7.4
+            base = faiss.downcast_index(base.base_index)
+        ivf = faiss.try_extract_index_ivf(base)
+        if ivf is not None:
+            ivf.nprobe = IVF_NPROBE
+    
+    def _ensure_writable(self):
+        """Replace the shared read-only mapping with a private mutable copy"""
+        if self._read_only:
+            self.index = faiss.clone_index(self.index)
+            self._read_only = False
+            self._apply_search_params()
+    
+    @staticmethod
+    def _binarize(embeddings):
+        """Pack the sign bits of each row into bytes (512 dims -> 64 bytes)"""
+        return np.packbits(embeddings > 0, axis=-1)
+    
+    @staticmethod
+    def _is_flat_ip(index):
+        """Exact inner-product index (downcast_index gives IndexFlat, not IndexFlatIP)"""
+        return isinstance(index, faiss.IndexFlat) and index.metric_type == faiss.METRIC_INNER_PRODUCT
+    
+    def _build_binary_index(self):
+        """(Re)build the binary gating index from a flat float index"""
+        base = self._base_index()
+        if not self._is_flat_ip(base):
+            self.bin_index = None
+            return
+        
+        self.bin_index = faiss.IndexBinaryFlat(self.embedding_dim)
+        if base.ntotal > 0:
+            self.bin_index.add(self._binarize(base.reconstruct_n(0, base.ntotal)))
+    
+    def _ids_of_rows(self, rows):
+        """Map flat-index row numbers to person ids (-1 stays -1)"""
+        if self._row_ids is None or len(self._row_ids) != self.index.ntotal:
+            self._row_ids = faiss.vector_to_array(self.index.id_map)
+        return np.where(rows >= 0, self._row_ids[rows], -1)
+    
+    def _small_gallery_search(self, embedding, k):
+        """Exact top-k over a small flat gallery with the compiled kernel"""
+        if self._gallery is None or len(self._gallery) != self.index.ntotal:
+            self._gallery = self._base_index().reconstruct_n(0, self.index.ntotal)
+        scores, rows = _topk_cosine(embedding[0], self._gallery, k)
+        return scores[None, :], self._ids_of_rows(rows)[None, :]
+    
+    def _gated_search(self, embedding, k):
+        """Hamming-distance shortlist, then exact inner product on the shortlist"""
+        _, candidates = self.bin_index.search(self._binarize(embedding), BINARY_CANDIDATES)
+        candidates = candidates[0][candidates[0] >= 0]
+        
+        similarities = self._base_index().reconstruct_batch(candidates) @ embedding[0]
+        order = np.argsort(-similarities)[:k]
+        return similarities[order][None, :], self._ids_of_rows(candidates[order])[None, :]
     
     def save_index(self):
         """Save FAISS index to disk"""
@@ -61,50 +379,83 @@ class FaceService:
             index_file = os.path.join(self.index_path, 'faiss.index')
             ids_file = os.path.join(self.index_path, 'person_ids.pkl')
             
-            faiss.write_index(self.index, index_file)
-            with open(ids_file, 'wb') as f:
-                pickle.dump(self.person_ids, f)
+            with self._index_lock:
+                # Write aside and rename: other workers may have the old file mapped,
+                # and rewriting it in place would change pages under them
+                faiss.write_index(self.index, index_file + '.tmp')
+                os.replace(index_file + '.tmp', index_file)
+                # Person ids now live in the index itself
+                if os.path.exists(ids_file):
+                    os.remove(ids_file)
             logger.info("FAISS index saved")
         except Exception as e:
             logger.error(f"Error saving FAISS index: {e}")
     
+    def _schedule_save(self):
+        """Mark the index dirty and make sure the background writer is running"""
+        self._dirty.set()
+        if self._writer is None:
+            with self._index_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._save_loop, daemon=True)
+                    self._writer.start()
+                    atexit.register(self.flush)
+    
+    def _save_loop(self):
+        """Coalesce every change made within SAVE_DEBOUNCE_SECONDS into one save"""
+        while True:
+            self._dirty.wait()
+            time.sleep(SAVE_DEBOUNCE_SECONDS)
+            self._dirty.clear()
+            self.save_index()
+    
+    def flush(self):
+        """Save now if changes are pending (also runs at interpreter exit)"""
+        if self._dirty.is_set():
+            self._dirty.clear()
+            self.save_index()
+    
     def base64_to_image(self, base64_string):
         """Convert base64 string to image"""
         if ',' in base64_string:
             base64_string = base64_string.split(',')[1]
         
+        # Decode straight to BGR (libjpeg-turbo inside OpenCV), no PIL round trip
         img_data = base64.b64decode(base64_string)
-        img = Image.open(io.BytesIO(img_data))
-        return cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
+        return cv2.imdecode(np.frombuffer(img_data, dtype=np.uint8), cv2.IMREAD_COLOR)
     
     def check_face_quality(self, image):
         """Check face image quality to prevent false positives"""
         try:
-            # Convert to grayscale for quality checks
-            if len(image.shape) == 3:
-                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            else:
-                gray = image
-            
             # Check image size
-            height, width = gray.shape[:2]
+            height, width = image.shape[:2]
             if height < 80 or width < 80:
                 return False, "Face too small (min 80x80)"
             
+            if _face_quality_stats is not None and image.dtype == np.uint8:
+                # Brightness, contrast and sharpness from one read of the pixels,
+                # gray or BGR, without a separate grayscale conversion
+                pixels = image if image.ndim == 3 else image[:, :, None]
+                brightness, contrast, laplacian_var = _face_quality_stats(np.ascontiguousarray(pixels))
+            else:
+                # Convert to grayscale for quality checks
+                gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+                brightness, contrast = cv2.meanStdDev(gray)
+                brightness, contrast = float(brightness[0, 0]), float(contrast[0, 0])
+                # Full resolution, like the compiled pass, so both gate blur the same way
+                laplacian_var = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+            
             # Check brightness
-            brightness = np.mean(gray)
             if brightness < 40:
                 return False, "Image too dark"
             if brightness > 220:
                 return False, "Image overexposed"
             
             # Check sharpness using Laplacian variance
-            laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
             if laplacian_var < 100:
                 return False, "Image too blurry"
             
             # Check contrast
-            contrast = gray.std()
             if contrast < 20:
                 return False, "Low contrast"
             
@@ -145,53 +496,217 @@ class FaceService:
             
             if result and len(result) > 0:
                 embedding = np.array(result[0]["embedding"], dtype=np.float32)
-                # Normalize embedding for better comparison
-                embedding = embedding / np.linalg.norm(embedding)
+                # Normalize embedding for better comparison (in place, through a 2-D view)
+                faiss.normalize_L2(embedding.reshape(1, -1))
                 return embedding
             return None
         except Exception as e:
             logger.error(f"Embedding extraction failed: {e}")
             return None
     
+    def _detect_face(self, image):
+        """Detect and align the first face, returning the model-ready (1, h, w, 3) crop"""
+        target_size = deepface_functions.find_target_size(model_name=self.model_name)
+        try:
+            faces = deepface_functions.extract_faces(
+                img=image,
+                target_size=target_size,
+                detector_backend=self.detector_backend,
+                grayscale=False,
+                enforce_detection=True,
+                align=True
+            )
+        except:
+            # Fallback to opencv detector if retinaface fails
+            logger.info("Falling back to opencv detector")
+            faces = deepface_functions.extract_faces(
+                img=image,
+                target_size=target_size,
+                detector_backend="opencv",
+                grayscale=False,
+                enforce_detection=True,
+                align=True
+            )
+        return deepface_functions.normalize_input(img=faces[0][0], normalization="base")
+    
+    def extract_embeddings_batch(self, images, check_quality=True):
+        """
+        Extract embeddings for several images with one model forward pass
+        Detection still runs per image; the aligned crops are stacked and
+        embedded together. Returns a list aligned with images, holding a
+        normalized embedding or None for images that failed quality/detection.
+        """
+        crops = []
+        positions = []
+        for i, image in enumerate(images):
+            try:
+                if check_quality:
+                    quality_ok, quality_msg = self.check_face_quality(image)
+                    if not quality_ok:
+                        logger.warning(f"Quality check failed: {quality_msg}")
+                        continue
+                crops.append(self._detect_face(image))
+                positions.append(i)
+            except Exception as e:
+                logger.error(f"Embedding extraction failed: {e}")
+        
+        results = [None] * len(images)
+        if not crops:
+            return results
+        
+        try:
+            if self.model is None:
+                self.model = DeepFace.build_model(self.model_name)
+            embeddings = np.ascontiguousarray(
+                self.model.predict(np.concatenate(crops), verbose=0, batch_size=32),
+                dtype=np.float32
+            )
+            faiss.normalize_L2(embeddings)
+        except Exception as e:
+            logger.error(f"Batch embedding failed: {e}")
+            return results
+        
+        for i, embedding in zip(positions, embeddings):
+            results[i] = embedding
+        return results
+    
     def add_person(self, person_id, embeddings):
         """Add person embeddings to FAISS index with normalization"""
+        return self.add_persons([(person_id, embeddings)])
+    
+    def add_persons(self, entries):
+        """
+        Add several persons' embeddings with one index.add and one save
+        Args:
+            entries: List of (person_id, embeddings) pairs
+        """
         try:
+            matrix, ids = self._stack_embeddings(entries)
+            if not ids:
+                return True
+            
+            self._add_normalized(matrix, ids)
+            self._schedule_save()
+            logger.info(f"Added {len(entries)} persons with {len(ids)} normalized embeddings")
+            return True
+        except Exception as e:
+            logger.error(f"Error adding persons: {e}")
+            return False
+    
+    def _stack_embeddings(self, entries):
+        """One contiguous, L2-normalized float32 matrix plus a person id per row"""
+        blocks = []
+        ids = []
+        for person_id, embeddings in entries:
             if not isinstance(embeddings, list):
                 embeddings = [embeddings]
-            
             for embedding in embeddings:
-                embedding = np.array(embedding, dtype=np.float32)
-                # Normalize embedding for cosine similarity
-                embedding = embedding / np.linalg.norm(embedding)
-                embedding = embedding.reshape(1, -1)
-                self.index.add(embedding)
-                self.person_ids.append(person_id)
+                block = np.asarray(embedding, dtype=np.float32).reshape(-1, self.embedding_dim)
+                blocks.append(block)
+                ids.extend([person_id] * len(block))
+        
+        if not blocks:
+            return np.empty((0, self.embedding_dim), dtype=np.float32), ids
+        
+        matrix = np.ascontiguousarray(np.vstack(blocks), dtype=np.float32)
+        # Normalize embeddings for cosine similarity (in place, one pass)
+        faiss.normalize_L2(matrix)
+        return matrix, ids
+    
+    def _add_normalized(self, matrix, ids):
+        """Append normalized rows to the index and its side structures"""
+        with self._index_lock:
+            self._ensure_writable()
+            self.index.add_with_ids(matrix, np.asarray(ids, dtype=np.int64))
+            self._gallery = None
+            if self.bin_index is not None:
+                self.bin_index.add(self._binarize(matrix))
+            for person_id in ids:
+                self._id_counts[person_id] = self._id_counts.get(person_id, 0) + 1
+            self._upgrade_to_ivf()
+    
+    def _upgrade_to_ivf(self):
+        """Retrain a flat gallery as IVF once it reaches IVF_MIN_EMBEDDINGS (one-off)"""
+        base = self._base_index()
+        if not self._is_flat_ip(base) or base.ntotal < IVF_MIN_EMBEDDINGS:
+            return
+        
+        start = time.monotonic()
+        vectors = base.reconstruct_n(0, base.ntotal)
+        ids = faiss.vector_to_array(self.index.id_map)
+        self.initialize_index(vectors)
+        self.index.add_with_ids(vectors, ids)
+        self._reset_side_structures()
+        logger.info(f"Moved {len(ids)} embeddings to an IVF index in {time.monotonic() - start:.1f}s")
+    
+    def remove_person(self, person_id):
+        """Remove all of a person's embeddings from the index"""
+        try:
+            with self._index_lock:
+                if isinstance(self._base_index(), faiss.IndexRefine):
+                    # IndexRefine has no remove_ids; rebuild without the person's rows
+                    removed = self._rebuild_without(person_id)
+                else:
+                    self._ensure_writable()
+                    removed = self.index.remove_ids(np.array([person_id], dtype=np.int64))
+                if removed == 0:
+                    return False
+                self._reset_side_structures()
             
-            self.save_index()
-            logger.info(f"Added person {person_id} with {len(embeddings)} normalized embeddings")
+            self._schedule_save()
+            logger.info(f"Removed {removed} embeddings for person {person_id}")
             return True
         except Exception as e:
-            logger.error(f"Error adding person: {e}")
+            logger.error(f"Error removing person: {e}")
             return False
     
+    def _rebuild_without(self, person_id):
+        """Swap in a copy of the index without one person's vectors (keeps training)"""
+        ids = faiss.vector_to_array(self.index.id_map)
+        keep = ids != person_id
+        removed = int(len(ids) - keep.sum())
+        if removed == 0:
+            return 0
+        
+        base = self._base_index()
+        vectors = base.reconstruct_n(0, base.ntotal)[keep]
+        empty = faiss.clone_index(base)
+        empty.reset()
+        index = faiss.IndexIDMap2(empty)
+        if len(vectors):
+            index.add_with_ids(np.ascontiguousarray(vectors), ids[keep])
+        self.index = index
+        self._read_only = False
+        self._apply_search_params()
+        return removed
+    
     def recognize_face(self, embedding, strict_mode=False):
         """Recognize face from embedding with anti-false-positive measures"""
         try:
             if self.index.ntotal == 0:
                 return None, 0.0
             
-            # Normalize embedding
-            embedding = np.array(embedding, dtype=np.float32)
-            embedding = embedding / np.linalg.norm(embedding)
-            embedding = embedding.reshape(1, -1)
+            # Normalize embedding (a private copy; normalize_L2 works in place)
+            embedding = np.array(embedding, dtype=np.float32).reshape(1, -1)
+            faiss.normalize_L2(embedding)
             
             # Search for top 3 matches to check for ambiguity
             k = min(3, self.index.ntotal)
-            scores, indices = self.index.search(embedding, k=k)
+            flat = self._is_flat_ip(self._base_index())
+            if _topk_cosine is not None and flat and self.index.ntotal < SMALL_GALLERY_MAX:
+                scores, indices = self._small_gallery_search(embedding, k)
+            elif flat and self.bin_index is not None and self.index.ntotal >= BINARY_GATE_MIN:
+                scores, indices = self._gated_search(embedding, k)
+            else:
+                scores, indices = self._batcher.search(self.index, embedding, k)
             
             # IndexFlatIP returns inner product scores (higher is better)
             # For normalized vectors, inner product = cosine similarity
-            similarities = [max(0.0, min(1.0, float(score))) for score in scores[0]]
+            # IVF may return fewer than k hits; missing slots have index -1
+            found = indices[0] >= 0
+            if not found.any():
+                return None, 0.0
+            similarities = np.clip(scores[0][found], 0.0, 1.0).tolist()
             
             best_similarity = similarities[0]
             threshold = self.strict_threshold if strict_mode else self.threshold
@@ -209,7 +724,7 @@ class FaceService:
                     logger.warning(f"Ambiguous match: best={best_similarity:.3f}, second={second_best:.3f}")
                     return None, best_similarity
             
-            person_id = self.person_ids[indices[0][0]]
+            person_id = int(indices[0][0])
             logger.info(f"Match found: person_id={person_id}, similarity={best_similarity:.3f}")
             return person_id, best_similarity
             
@@ -220,12 +735,20 @@ class FaceService:
     def rebuild_index_from_db(self, db_persons):
         """Rebuild FAISS index from database persons"""
         try:
-            self.initialize_index()
+            gallery = [
+                (person.id, person.get_embedding())
+                for person in db_persons
+                if person.embedding and person.status == 'active'
+            ]
             
-            for person in db_persons:
-                if person.embedding and person.status == 'active':
-                    embedding = pickle.loads(person.embedding)
-                    self.add_person(person.id, embedding)
+            # One matrix for the whole gallery: trains an IVF index when it is
+            # large enough, then goes in with a single add and a single save
+            matrix, ids = self._stack_embeddings(gallery)
+            with self._index_lock:
+                self.initialize_index(matrix)
+                if ids:
+                    self._add_normalized(matrix, ids)
+            self.save_index()
             
             logger.info(f"Rebuilt FAISS index with {len(db_persons)} persons")
             return True
@@ -236,7 +759,7 @@ class FaceService:
     def get_stats(self):
         """Get index statistics"""
         return {
-            'total_persons': len(set(self.person_ids)),
+            'total_persons': len(self._id_counts),
             'total_embeddings': self.index.ntotal,
             'embedding_dim': self.embedding_dim
         }
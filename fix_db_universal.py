@@ -30,10 +30,8 @@ try:
         """Modify system_logs table to allow NULL user_id"""
         with app.app_context():
             try:
-                inspector = inspect(db.engine)
-                
                 # Check if table exists
-                if 'system_logs' not in inspector.get_table_names():
+                if not inspect(db.engine).has_table('system_logs'):
                     logger.info("✅ system_logs table doesn't exist yet - will be created with correct schema")
                     return
                 
@@ -41,53 +39,19 @@ try:
                 if 'sqlite' in str(db.engine.url):
                     logger.info("Detected SQLite database")
                     
-                    # Test if user_id already allows NULL
-                    try:
-                        db.session.execute(text("""
-                            INSERT INTO system_logs (action, user_type, user_id, user_email, ip_address)
-                            VALUES ('test', 'user', NULL, 'test@example.com', '0.0.0.0')
-                        """))
-                        db.session.rollback()
+                    # Check if user_id already allows NULL (schema metadata, no test write)
+                    columns = db.session.execute(text("PRAGMA table_info(system_logs)")).fetchall()
+                    needs_fix = any(col[1] == 'user_id' and col[3] == 1 for col in columns)
+                    if not needs_fix:
                         logger.info("✅ system_logs.user_id already allows NULL - no fix needed")
                         return
-                    except Exception as e:
-                        if "NOT NULL constraint failed" in str(e):
-                            db.session.rollback()
-                            logger.info("Fixing system_logs table...")
-                            
-                            # Create new table with correct schema
-                            db.session.execute(text("""
-                                CREATE TABLE system_logs_new (
-                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    action VARCHAR(100) NOT NULL,
-                                    user_type VARCHAR(20) NOT NULL,
-                                    user_id INTEGER,
-                                    user_email VARCHAR(120) NOT NULL,
-                                    details TEXT,
-                                    ip_address VARCHAR(50),
-                                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                                )
-                            """))
-                            
-                            # Copy data
-                            db.session.execute(text("""
-                                INSERT INTO system_logs_new 
-                                SELECT * FROM system_logs
-                            """))
-                            
-                            # Replace old table
-                            db.session.execute(text("DROP TABLE system_logs"))
-                            db.session.execute(text("ALTER TABLE system_logs_new RENAME TO system_logs"))
-                            
-                            # Recreate index
-                            db.session.execute(text("""
-                                CREATE INDEX idx_system_logs_timestamp ON system_logs (timestamp DESC)
-                            """))
-                            
-                            db.session.commit()
-                            logger.info("✅ Successfully fixed system_logs table!")
-                        else:
-                            raise
+                    
+                    logger.info("Fixing system_logs table...")
+                    db.session.close()
+                    
+                    from fix_system_logs import allow_null_user_id
+                    allow_null_user_id(db.engine)
+                    logger.info("✅ Successfully fixed system_logs table!")
                 
                 # For PostgreSQL databases
                 elif 'postgres' in str(db.engine.url):
@@ -123,35 +87,39 @@ except ImportError as e:
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
-    try:
-        # Test if fix is needed
-        cursor.execute("""
-            INSERT INTO system_logs (action, user_type, user_id, user_email, ip_address)
-            VALUES ('test', 'user', NULL, 'test@example.com', '0.0.0.0')
-        """)
-        conn.rollback()
+    # Check if user_id already allows NULL (schema metadata, no test write)
+    cursor.execute("PRAGMA table_info(system_logs)")
+    columns = cursor.fetchall()
+    if not columns:
+        print("✅ system_logs table doesn't exist yet - will be created with correct schema")
+    elif not any(col[1] == 'user_id' and col[3] == 1 for col in columns):
         print("✅ system_logs.user_id already allows NULL")
-    except sqlite3.IntegrityError:
-        conn.rollback()
+    else:
         print("Applying fix...")
-        
-        cursor.execute("""CREATE TABLE system_logs_new (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            action VARCHAR(100) NOT NULL,
-            user_type VARCHAR(20) NOT NULL,
-            user_id INTEGER,
-            user_email VARCHAR(120) NOT NULL,
-            details TEXT,
-            ip_address VARCHAR(50),
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )""")
-        
-        cursor.execute("INSERT INTO system_logs_new SELECT * FROM system_logs")
-        cursor.execute("DROP TABLE system_logs")
-        cursor.execute("ALTER TABLE system_logs_new RENAME TO system_logs")
-        cursor.execute("CREATE INDEX idx_system_logs_timestamp ON system_logs (timestamp DESC)")
-        
-        conn.commit()
+        from fix_system_logs import relax_user_id_in_place
+        if not relax_user_id_in_place(conn):
+            # Unrecognised column definition: copy the table, all in one transaction
+            names = ", ".join(col[1] for col in columns)
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("""CREATE TABLE system_logs_new (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    action VARCHAR(100) NOT NULL,
+                    user_type VARCHAR(20) NOT NULL,
+                    user_id INTEGER,
+                    user_email VARCHAR(120) NOT NULL,
+                    details TEXT,
+                    ip_address VARCHAR(50),
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                )""")
+                cursor.execute(f"INSERT INTO system_logs_new ({names}) SELECT {names} FROM system_logs")
+                cursor.execute("DROP TABLE system_logs")
+                cursor.execute("ALTER TABLE system_logs_new RENAME TO system_logs")
+                cursor.execute("CREATE INDEX idx_system_logs_timestamp ON system_logs (timestamp DESC)")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
         print("✅ Fix applied successfully!")
     
     conn.close()
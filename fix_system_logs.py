@@ -4,10 +4,71 @@ Quick fix for system_logs table to allow NULL user_id
 import sqlite3
 import logging
 import os
+import re
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def relax_user_id_in_place(conn):
+    """
+    Drop NOT NULL from system_logs.user_id by editing the stored schema
+    Removing a NOT NULL constraint doesn't change the on-disk format, so SQLite
+    allows it through writable_schema without rewriting any rows. Returns False
+    when the column definition isn't recognised
+    """
+    cursor = conn.cursor()
+    sql = cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' AND name='system_logs'"
+    ).fetchone()[0]
+    new_sql, count = re.subn(
+        r'(["`\[]?user_id["`\]]?\s+INTEGER)\s+NOT\s+NULL', r'\1', sql, count=1, flags=re.IGNORECASE
+    )
+    if not count:
+        return False
+    
+    schema_version = cursor.execute("PRAGMA schema_version").fetchone()[0]
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("PRAGMA writable_schema = ON")
+        cursor.execute(
+            "UPDATE sqlite_master SET sql = ? WHERE type='table' AND name='system_logs'",
+            (new_sql,)
+        )
+        # Bumping the schema cookie makes other connections reload the schema
+        cursor.execute(f"PRAGMA schema_version = {schema_version + 1}")
+        cursor.execute("PRAGMA writable_schema = OFF")
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    
+    result = cursor.execute("PRAGMA quick_check").fetchone()[0]
+    if result != 'ok':
+        raise sqlite3.DatabaseError(f"system_logs schema edit failed quick_check: {result}")
+    return True
+
+def rebuild_system_logs(engine):
+    """Recreate system_logs with a nullable user_id through Alembic's batch mode"""
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+    from sqlalchemy import Integer
+    
+    # Batch mode copies the table and recreates its indexes in one transaction
+    with engine.begin() as conn:
+        op = Operations(MigrationContext.configure(conn))
+        with op.batch_alter_table('system_logs', recreate='always') as batch_op:
+            batch_op.alter_column('user_id', existing_type=Integer, nullable=True)
+
+def allow_null_user_id(engine):
+    """Make system_logs.user_id nullable, in place when possible"""
+    raw = engine.raw_connection()
+    try:
+        relaxed = relax_user_id_in_place(raw.driver_connection)
+    finally:
+        raw.close()
+    if not relaxed:
+        rebuild_system_logs(engine)
+
 def fix_system_logs():
     """Modify system_logs table to allow NULL user_id"""
     try:
@@ -42,51 +103,22 @@ def fix_system_logs():
             conn.close()
             return
         
-        # Test if user_id already allows NULL
-        try:
-            cursor.execute("""
-                INSERT INTO system_logs (action, user_type, user_id, user_email, ip_address)
-                VALUES ('test', 'user', NULL, 'test@example.com', '0.0.0.0')
-            """)
-            conn.rollback()
+        # Check if user_id already allows NULL (schema metadata, no test write)
+        cursor.execute("PRAGMA table_info(system_logs)")
+        needs_fix = any(col[1] == 'user_id' and col[3] == 1 for col in cursor.fetchall())
+        if not needs_fix:
             logger.info("✅ system_logs.user_id already allows NULL - no migration needed")
             conn.close()
             return
-        except sqlite3.IntegrityError as e:
-            if "NOT NULL constraint failed" not in str(e):
-                raise
-            # Need to modify the table
-            logger.info("Modifying system_logs table to allow NULL user_id...")
-        
-        # Create a new table with the correct schema
-        cursor.execute("""
-            CREATE TABLE system_logs_new (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                action VARCHAR(100) NOT NULL,
-                user_type VARCHAR(20) NOT NULL,
-                user_id INTEGER,
-                user_email VARCHAR(120) NOT NULL,
-                details TEXT,
-                ip_address VARCHAR(50),
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Copy existing data
-        cursor.execute("""
-            INSERT INTO system_logs_new (id, action, user_type, user_id, user_email, details, ip_address, timestamp)
-            SELECT id, action, user_type, user_id, user_email, details, ip_address, timestamp
-            FROM system_logs
-        """)
         
-        # Drop old table and rename new one
-        cursor.execute("DROP TABLE system_logs")
-        cursor.execute("ALTER TABLE system_logs_new RENAME TO system_logs")
-        
-        # Recreate index
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_system_logs_timestamp ON system_logs (timestamp DESC)")
-        
-        conn.commit()
+        # Need to modify the table
+        logger.info("Modifying system_logs table to allow NULL user_id...")
+        from sqlalchemy import create_engine
+        engine = create_engine(f"sqlite:///{os.path.abspath(db_path)}")
+        try:
+            allow_null_user_id(engine)
+        finally:
+            engine.dispose()
         logger.info("✅ Successfully modified system_logs table to allow NULL user_id")
         conn.close()
         
@@ -4,230 +4,155 @@ Adds missing columns to existing tables
 """
 import logging
 from app import app, db
-from sqlalchemy import text
+from models import Person
+from sqlalchemy import inspect, text
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Columns added after the initial schema, per table
+MIGRATION_COLUMNS = {
+    'users': [
+        ('email_verified', 'BOOLEAN DEFAULT FALSE'),
+        ('verified_at', 'DATETIME'),
+    ],
+    'signup_requests': [
+        ('documents', 'TEXT'),  # JSON data
+        ('processed_by', 'VARCHAR(255)'),
+        ('processed_at', 'DATETIME'),
+        ('rejection_reason', 'TEXT'),
+    ],
+    'enrollment_requests': [
+        ('quality_scores', 'TEXT'),  # JSON data
+        ('processed_by', 'VARCHAR(255)'),
+        ('processed_at', 'DATETIME'),
+        ('rejection_reason', 'TEXT'),
+    ],
+    'persons': [
+        ('embedding_dtype', 'VARCHAR(8)'),  # NULL marks blobs written before the column
+    ],
+}
+
+# Columns declared NOT NULL on the models, with the value that replaces old NULLs
+NOT_NULL_COLUMNS = {
+    'super_admins': [('created_at', 'CURRENT_TIMESTAMP'), ('is_active', 'TRUE')],
+    'admins': [('created_at', 'CURRENT_TIMESTAMP'), ('is_active', 'TRUE')],
+    'users': [('created_at', 'CURRENT_TIMESTAMP'), ('status', "'active'")],
+    'email_verifications': [('created_at', 'CURRENT_TIMESTAMP')],
+    'persons': [('photos_count', '0')],
+    'attendance': [('confidence', '0')],
+}
+
+def user_id_allows_null(conn, dialect):
+    """Read system_logs.user_id nullability from the catalog"""
+    if dialect == 'sqlite':
+        columns = conn.execute(text("PRAGMA table_info(system_logs)")).fetchall()
+        return not any(col[1] == 'user_id' and col[3] == 1 for col in columns)
+    result = conn.execute(text("""
+        SELECT is_nullable FROM information_schema.columns
+        WHERE table_name = 'system_logs' AND column_name = 'user_id'
+    """)).fetchone()
+    return result is None or result[0] == 'YES'
+
 def migrate_database():
     """Add missing columns to database tables"""
     with app.app_context():
         try:
-            # Check and add missing columns to users table
-            logger.info("Checking users table...")
-            
-            # Add email_verified column if it doesn't exist
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE users ADD COLUMN email_verified BOOLEAN DEFAULT FALSE
-                """))
-                db.session.commit()
-                logger.info("✅ Added email_verified column to users table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  email_verified column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Add verified_at column if it doesn't exist
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE users ADD COLUMN verified_at DATETIME
-                """))
-                db.session.commit()
-                logger.info("✅ Added verified_at column to users table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  verified_at column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Check and add missing columns to signup_requests table
-            logger.info("Checking signup_requests table...")
-            
-            # Add documents column if it doesn't exist (for JSON data)
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE signup_requests ADD COLUMN documents TEXT
-                """))
-                db.session.commit()
-                logger.info("✅ Added documents column to signup_requests table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  documents column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Add processed_by column if it doesn't exist
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE signup_requests ADD COLUMN processed_by VARCHAR(255)
-                """))
-                db.session.commit()
-                logger.info("✅ Added processed_by column to signup_requests table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  processed_by column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Add processed_at column if it doesn't exist
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE signup_requests ADD COLUMN processed_at DATETIME
-                """))
-                db.session.commit()
-                logger.info("✅ Added processed_at column to signup_requests table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  processed_at column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Check and add rejection_reason column if it doesn't exist
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE signup_requests ADD COLUMN rejection_reason TEXT
-                """))
-                db.session.commit()
-                logger.info("✅ Added rejection_reason column to signup_requests table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  rejection_reason column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Check and add missing columns to enrollment_requests table
-            logger.info("Checking enrollment_requests table...")
-            
-            # Add quality_scores column if it doesn't exist (for JSON data)
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE enrollment_requests ADD COLUMN quality_scores TEXT
-                """))
-                db.session.commit()
-                logger.info("✅ Added quality_scores column to enrollment_requests table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  quality_scores column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Add processed_by column to enrollment_requests if it doesn't exist
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE enrollment_requests ADD COLUMN processed_by VARCHAR(255)
-                """))
-                db.session.commit()
-                logger.info("✅ Added processed_by column to enrollment_requests table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  processed_by column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Add processed_at column to enrollment_requests if it doesn't exist
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE enrollment_requests ADD COLUMN processed_at DATETIME
-                """))
-                db.session.commit()
-                logger.info("✅ Added processed_at column to enrollment_requests table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  processed_at column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Add rejection_reason column to enrollment_requests if it doesn't exist
-            try:
-                db.session.execute(text("""
-                    ALTER TABLE enrollment_requests ADD COLUMN rejection_reason TEXT
-                """))
-                db.session.commit()
-                logger.info("✅ Added rejection_reason column to enrollment_requests table")
-            except Exception as e:
-                if "already exists" in str(e) or "duplicate column" in str(e).lower():
-                    logger.info("⏭️  rejection_reason column already exists")
-                    db.session.rollback()
-                else:
-                    raise
-            
-            # Check and modify system_logs table to allow NULL user_id
-            logger.info("Checking system_logs table...")
-            
-            # For SQLite, we need to check if the column constraint needs modification
-            try:
-                # Check if system_logs table exists and has data
-                result = db.session.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name='system_logs'"))
-                if result.fetchone():
-                    # SQLite doesn't support ALTER COLUMN directly, so we need to recreate the table
-                    # First, check if user_id already allows NULL
-                    try:
-                        db.session.execute(text("""
-                            INSERT INTO system_logs (action, user_type, user_id, user_email, ip_address)
-                            VALUES ('test', 'user', NULL, 'test@example.com', '0.0.0.0')
-                        """))
-                        db.session.rollback()
-                        logger.info("⏭️  system_logs.user_id already allows NULL")
-                    except Exception as test_e:
-                        if "NOT NULL constraint failed" in str(test_e):
-                            db.session.rollback()
-                            # Need to modify the table
-                            logger.info("Modifying system_logs table to allow NULL user_id...")
-                            
-                            # Create a temporary table with the new schema
-                            db.session.execute(text("""
-                                CREATE TABLE system_logs_new (
-                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    action VARCHAR(100) NOT NULL,
-                                    user_type VARCHAR(20) NOT NULL,
-                                    user_id INTEGER,
-                                    user_email VARCHAR(120) NOT NULL,
-                                    details TEXT,
-                                    ip_address VARCHAR(50),
-                                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                                )
-                            """))
-                            
-                            # Copy existing data
-                            db.session.execute(text("""
-                                INSERT INTO system_logs_new (id, action, user_type, user_id, user_email, details, ip_address, timestamp)
-                                SELECT id, action, user_type, user_id, user_email, details, ip_address, timestamp
-                                FROM system_logs
-                            """))
-                            
-                            # Drop old table and rename new one
-                            db.session.execute(text("DROP TABLE system_logs"))
-                            db.session.execute(text("ALTER TABLE system_logs_new RENAME TO system_logs"))
-                            
-                            # Recreate index
-                            db.session.execute(text("""
-                                CREATE INDEX idx_system_logs_timestamp ON system_logs (timestamp DESC)
-                            """))
-                            
-                            db.session.commit()
-                            logger.info("✅ Modified system_logs table to allow NULL user_id")
+            # Read the schema once and only ALTER for columns that are missing
+            insp = inspect(db.engine)
+            existing = {
+                table: {c['name'] for c in insp.get_columns(table)}
+                for table in MIGRATION_COLUMNS
+            }
+            
+            # All DDL below shares one transaction and one commit
+            dialect = db.engine.dialect.name
+            rebuild_logs = False
+            with db.engine.begin() as conn:
+                for table, columns in MIGRATION_COLUMNS.items():
+                    logger.info(f"Checking {table} table...")
+                    missing = []
+                    for name, ddl in columns:
+                        if name in existing[table]:
+                            logger.info(f"⏭️  {name} column already exists")
                         else:
-                            db.session.rollback()
-                            raise
-                else:
+                            missing.append((name, ddl))
+                    if not missing:
+                        continue
+                    
+                    if dialect == 'postgresql':
+                        # Postgres takes every ADD COLUMN in one statement, but has no DATETIME
+                        clauses = ", ".join(
+                            f"ADD COLUMN {name} {ddl.replace('DATETIME', 'TIMESTAMP')}"
+                            for name, ddl in missing
+                        )
+                        conn.execute(text(f"ALTER TABLE {table} {clauses}"))
+                    else:
+                        # SQLite only adds one column per ALTER TABLE
+                        for name, ddl in missing:
+                            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+                    for name, _ in missing:
+                        logger.info(f"✅ Added {name} column to {table} table")
+                
+                # The column used to default to 'float32', which also labelled old
+                # pickles; code never writes that label, so unlabel those rows
+                if 'embedding_dtype' in existing['persons']:
+                    result = conn.execute(text(
+                        "UPDATE persons SET embedding_dtype = NULL WHERE embedding_dtype = 'float32'"
+                    ))
+                    if result.rowcount:
+                        logger.info(f"✅ Unlabelled {result.rowcount} legacy embeddings")
+                    if dialect == 'postgresql':
+                        conn.execute(text("ALTER TABLE persons ALTER COLUMN embedding_dtype DROP DEFAULT"))
+                
+                # Check and modify system_logs table to allow NULL user_id
+                logger.info("Checking system_logs table...")
+                
+                if not insp.has_table('system_logs'):
                     logger.info("⏭️  system_logs table doesn't exist yet")
-            except Exception as e:
-                if "already exists" in str(e).lower() or "table" in str(e).lower() and "exists" in str(e).lower():
-                    logger.info("⏭️  system_logs migration already applied or table structure is correct")
-                    db.session.rollback()
+                elif user_id_allows_null(conn, dialect):
+                    logger.info("⏭️  system_logs.user_id already allows NULL")
+                elif dialect == 'sqlite':
+                    # SQLite doesn't support ALTER COLUMN; the table is recreated below
+                    rebuild_logs = True
                 else:
-                    raise
+                    conn.execute(text("ALTER TABLE system_logs ALTER COLUMN user_id DROP NOT NULL"))
+                    logger.info("✅ Modified system_logs table to allow NULL user_id")
+                
+                # Backfill NULLs first so the constraint can't fail; SQLite can't
+                # add NOT NULL without a rebuild, so there it's only declared on new tables
+                logger.info("Checking NOT NULL columns...")
+                for table, columns in NOT_NULL_COLUMNS.items():
+                    nullable = {c['name'] for c in insp.get_columns(table) if c['nullable']}
+                    for name, fill in columns:
+                        if name not in nullable:
+                            continue
+                        result = conn.execute(text(f"UPDATE {table} SET {name} = {fill} WHERE {name} IS NULL"))
+                        if result.rowcount:
+                            logger.info(f"✅ Filled {result.rowcount} NULL {table}.{name} values")
+                        if dialect == 'postgresql':
+                            conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {name} SET NOT NULL"))
+                            logger.info(f"✅ Made {table}.{name} NOT NULL")
+            
+            if rebuild_logs:
+                logger.info("Modifying system_logs table to allow NULL user_id...")
+                db.session.close()
+                from fix_system_logs import allow_null_user_id
+                allow_null_user_id(db.engine)
+                logger.info("✅ Modified system_logs table to allow NULL user_id")
+            
+            # Convert pickled and float32 face embeddings (unlabelled) to raw float16 bytes
+            logger.info("Checking persons embeddings...")
+            converted = 0
+            for person in Person.query.all():
+                if person.embedding and person.embedding_dtype != 'float16':
+                    person.set_embedding(person.get_embedding())
+                    converted += 1
+            if converted:
+                db.session.commit()
+                logger.info(f"✅ Converted {converted} embeddings to raw float16 bytes")
+            else:
+                logger.info("⏭️  embeddings already stored as raw float16 bytes")
             
             logger.info("\n✅ Database migration completed successfully!")
             logger.info("All required columns have been added or already exist.")
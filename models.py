@@ -1,10 +1,61 @@
-from datetime import datetime
+import math
+import pickle
+import numpy as np
+from datetime import datetime, time, timedelta
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:
+    PasswordHasher = None
+
 db = SQLAlchemy()
 
-class SuperAdmin(db.Model):
+# Argon2id (RFC 9106's 64 MiB profile) when argon2-cffi is installed
+_password_hasher = (
+    PasswordHasher(time_cost=2, memory_cost=65536, parallelism=1)
+    if PasswordHasher is not None else None
+)
+
+# Werkzeug's scrypt default, used without argon2-cffi
+PASSWORD_HASH_METHOD = 'scrypt:32768:8:1'
+
+class PasswordMixin:
+    """set_password/check_password for models with a password_hash column"""
+    
+    def set_password(self, password):
+        if _password_hasher is not None:
+            self.password_hash = _password_hasher.hash(password)
+        else:
+            self.password_hash = generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+    
+    def check_password(self, password):
+        """
+        Verify a password, upgrading outdated hashes in place
+        The upgrade is saved by the caller's next commit (login always commits)
+        """
+        if not self.password_hash.startswith('$argon2'):
+            # werkzeug scrypt/pbkdf2 hash from before Argon2
+            if not check_password_hash(self.password_hash, password):
+                return False
+            if _password_hasher is not None:
+                self.set_password(password)
+            return True
+        
+        if _password_hasher is None:
+            return False
+        try:
+            _password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        if _password_hasher.check_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
+
+
+class SuperAdmin(PasswordMixin, db.Model):
     """Super Admin with full system control"""
     __tablename__ = 'super_admins'
     
@@ -13,15 +64,9 @@ class SuperAdmin(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(255), nullable=False)
     profile_image = db.Column(db.Text, default='')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_login = db.Column(db.DateTime)
-    is_active = db.Column(db.Boolean, default=True)
-    
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-    
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+    is_active = db.Column(db.Boolean, default=True, nullable=False)
     
     def to_dict(self):
         return {
@@ -36,7 +81,7 @@ class SuperAdmin(db.Model):
         }
 
 
-class Admin(db.Model):
+class Admin(PasswordMixin, db.Model):
     """Admin user model"""
     __tablename__ = 'admins'
     
@@ -46,17 +91,11 @@ class Admin(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     profile_image = db.Column(db.Text, default='')
     department = db.Column(db.String(100), default='')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_login = db.Column(db.DateTime)
-    is_active = db.Column(db.Boolean, default=True)
+    is_active = db.Column(db.Boolean, default=True, nullable=False)
     created_by = db.Column(db.Integer, db.ForeignKey('super_admins.id'))
     
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-    
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
-    
     def to_dict(self):
         return {
             'id': self.id,
@@ -71,7 +110,7 @@ class Admin(db.Model):
         }
 
 
-class User(db.Model):
+class User(PasswordMixin, db.Model):
     """Regular user model"""
     __tablename__ = 'users'
     
@@ -82,18 +121,23 @@ class User(db.Model):
     department = db.Column(db.String(100), default='')
     phone = db.Column(db.String(20), default='')
     profile_image = db.Column(db.Text, default='')
-    status = db.Column(db.String(20), default='active')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(db.String(20), default='active', nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     last_login = db.Column(db.DateTime)
     is_enrolled = db.Column(db.Boolean, default=False)
     email_verified = db.Column(db.Boolean, default=False)
     verified_at = db.Column(db.DateTime, nullable=True)
     
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+    __table_args__ = (
+        db.Index('idx_users_status', status),
+    )
     
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+    person_profile = db.relationship('Person', back_populates='user')
+    verification_codes = db.relationship('EmailVerification', back_populates='user')
+    enrollment_requests = db.relationship('EnrollmentRequest', back_populates='user')
+    leave_requests = db.relationship('LeaveRequest', back_populates='user')
+    # Unbounded history: page through Attendance by user_id instead
+    attendance_records = db.relationship('Attendance', back_populates='user', lazy='raise')
     
     def to_dict(self):
         return {
@@ -122,11 +166,46 @@ class Person(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     embedding = db.Column(db.LargeBinary, nullable=False)
     embedding_dim = db.Column(db.Integer, nullable=False)
-    photos_count = db.Column(db.Integer, default=0)
+    # NULL on rows from before the column: the original pickles or raw float32
+    embedding_dtype = db.Column(db.String(8))
+    photos_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     status = db.Column(db.String(20), default='active')
     enrollment_date = db.Column(db.DateTime, default=datetime.utcnow)
     
-    user = db.relationship('User', backref='person_profile')
+    __table_args__ = (
+        db.Index('idx_persons_status', status),
+    )
+    
+    user = db.relationship('User', back_populates='person_profile')
+    attendance_records = db.relationship('Attendance', back_populates='person', lazy='raise')
+    
+    def set_embedding(self, embedding):
+        """Store the embedding as raw float16 bytes, half the size of float32"""
+        embedding = np.asarray(embedding, dtype=np.float16)
+        self.embedding = embedding.tobytes()
+        self.embedding_dim = embedding.shape[-1]
+        self.embedding_dtype = 'float16'
+    
+    def get_embedding(self):
+        """Embedding as a (n, embedding_dim) float32 array"""
+        dtype = self.stored_dtype()
+        if dtype == 'pickle':
+            return np.asarray(pickle.loads(self.embedding), dtype=np.float32).reshape(-1, self.embedding_dim)
+        raw = np.frombuffer(self.embedding, dtype=dtype)
+        return raw.astype(np.float32, copy=False).reshape(-1, self.embedding_dim)
+    
+    def stored_dtype(self):
+        """How the blob is stored: 'float16', 'float32' or 'pickle'"""
+        if self.embedding_dtype:
+            return self.embedding_dtype
+        # Unlabelled legacy row; only a real pickle starts with PROTO and loads
+        if self.embedding[:1] == pickle.PROTO:
+            try:
+                pickle.loads(self.embedding)
+                return 'pickle'
+            except Exception:
+                pass
+        return 'float32'
     
     def to_dict(self):
         return {
@@ -148,10 +227,10 @@ class EmailVerification(db.Model):
     email = db.Column(db.String(120), nullable=False, index=True)
     verification_code = db.Column(db.String(6), nullable=False)
     is_used = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     expires_at = db.Column(db.DateTime, nullable=False)
     
-    user = db.relationship('User', backref='verification_codes')
+    user = db.relationship('User', back_populates='verification_codes')
     
     def to_dict(self):
         return {
@@ -164,7 +243,7 @@ class EmailVerification(db.Model):
         }
 
 
-class SignupRequest(db.Model):
+class SignupRequest(PasswordMixin, db.Model):
     """Signup request from new users requiring admin approval"""
     __tablename__ = 'signup_requests'
     
@@ -175,7 +254,8 @@ class SignupRequest(db.Model):
     phone = db.Column(db.String(20), default='')
     department = db.Column(db.String(100), default='')
     profile_image = db.Column(db.Text, default='')
-    documents = db.Column(db.JSON, default=[])  # Store uploaded documents/images
+    # Uploaded documents/images; deferred so queries that don't show them skip the payload
+    documents = db.deferred(db.Column(db.JSON, default=[]))
     status = db.Column(db.String(20), default='pending', index=True)  # pending, approved, rejected
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
     processed_at = db.Column(db.DateTime, nullable=True)
@@ -184,8 +264,9 @@ class SignupRequest(db.Model):
     requires_verification = db.Column(db.Boolean, default=False)
     verification_sent_at = db.Column(db.DateTime, nullable=True)
     
-    def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+    __table_args__ = (
+        db.Index('idx_signup_status', status),
+    )
     
     def to_dict(self, include_documents=False):
         data = {
@@ -215,7 +296,7 @@ class EnrollmentRequest(db.Model):
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), nullable=False, index=True)
     phone = db.Column(db.String(20), default='')
-    images = db.Column(db.JSON, nullable=False)
+    images = db.deferred(db.Column(db.JSON, nullable=False))  # base64 payloads, loaded on access
     quality_scores = db.Column(db.JSON, default=[])  # Quality scores for each image
     status = db.Column(db.String(20), default='pending', index=True)
     submitted_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -223,7 +304,13 @@ class EnrollmentRequest(db.Model):
     processed_by = db.Column(db.String(120), nullable=True)
     rejection_reason = db.Column(db.Text, nullable=True)
     
-    user = db.relationship('User', backref='enrollment_requests')
+    __table_args__ = (
+        db.Index('idx_enrollment_status', status),
+        db.Index('idx_enrollment_user_submitted', user_id, submitted_at.desc()),
+    )
+    
+    # lazy='raise': list endpoints must selectinload the user instead of N+1 lazy loads
+    user = db.relationship('User', back_populates='enrollment_requests', lazy='raise')
     
     def to_dict(self, include_images=False):
         data = {
@@ -260,7 +347,12 @@ class LeaveRequest(db.Model):
     processed_by = db.Column(db.String(120), nullable=True)
     rejection_reason = db.Column(db.Text, nullable=True)
     
-    user = db.relationship('User', backref='leave_requests')
+    __table_args__ = (
+        db.Index('idx_leave_status', status),
+        db.Index('idx_leave_dates', start_date, end_date),
+    )
+    
+    user = db.relationship('User', back_populates='leave_requests', lazy='raise')
     
     def to_dict(self):
         return {
@@ -285,23 +377,66 @@ class Attendance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     person_id = db.Column(db.Integer, db.ForeignKey('persons.id'))
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
-    name = db.Column(db.String(100), nullable=False, index=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    confidence = db.Column(db.Float, default=0.0)
+    name = db.Column(db.String(100), nullable=False)  # idx_attendance_name_timestamp leads with it
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    confidence = db.Column(db.Float, default=0.0, server_default='0', nullable=False)
     image_data = db.Column(db.Text, nullable=True)
     
-    person = db.relationship('Person', backref='attendance_records')
-    user = db.relationship('User', backref='attendance_records')
-    
-    def to_dict(self):
+    __table_args__ = (
+        # On Postgres these carry the select_rows() columns for index-only scans
+        db.Index('idx_attendance_ts_cov', timestamp.desc(),
+                 postgresql_include=['id', 'person_id', 'user_id', 'name', 'confidence']),
+        db.Index('idx_attendance_name_timestamp', name, timestamp.desc()),
+        db.Index('idx_attendance_user_ts_cov', user_id, timestamp.desc(),
+                 postgresql_include=['id', 'person_id', 'name', 'confidence']),
+    )
+    
+    person = db.relationship('Person', back_populates='attendance_records', lazy='raise')
+    user = db.relationship('User', back_populates='attendance_records', lazy='raise')
+    
+    @classmethod
+    def on_date(cls, day):
+        """
+        Filter for records on a calendar day
+        Half-open timestamp range, so the plain timestamp index can be used
+        (DATE(timestamp) = day can't use it)
+        """
+        start = datetime.combine(day, time.min)
+        return db.and_(cls.timestamp >= start, cls.timestamp < start + timedelta(days=1))
+    
+    @classmethod
+    def select_rows(cls):
+        """Select of just the to_dict columns, for list endpoints that skip the ORM"""
+        return db.select(cls.id, cls.person_id, cls.user_id, cls.name, cls.timestamp, cls.confidence)
+    
+    @classmethod
+    def page_rows(cls, *criteria, page=1, per_page=50):
+        """
+        One page of select_rows(), newest first, with the total count and page count
+        Flask-SQLAlchemy's paginate() always returns scalars, so the page is fetched here
+        """
+        page, per_page = max(page, 1), max(per_page, 1)
+        total = db.session.scalar(db.select(db.func.count(cls.id)).where(*criteria))
+        rows = db.session.execute(
+            cls.select_rows().where(*criteria).order_by(cls.timestamp.desc())
+            .offset((page - 1) * per_page).limit(per_page)
+        ).all()
+        return rows, total, math.ceil(total / per_page)
+    
+    @staticmethod
+    def row_to_dict(row):
+        """Serialize a select_rows() row (or an Attendance instance)"""
         return {
-            'id': self.id,
-            'person_id': self.person_id,
-            'user_id': self.user_id,
-            'name': self.name,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'confidence': round(self.confidence, 3)
+            'id': row.id,
+            'person_id': row.person_id,
+            'user_id': row.user_id,
+            'name': row.name,
+            'timestamp': row.timestamp.isoformat() if row.timestamp else None,
+            'confidence': round(row.confidence, 3)
         }
+    
+    def to_dict(self):
+        return self.row_to_dict(self)
 
 
 class SystemLog(db.Model):
@@ -315,7 +450,11 @@ class SystemLog(db.Model):
     user_email = db.Column(db.String(120), nullable=False)
     details = db.Column(db.Text)
     ip_address = db.Column(db.String(50))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('idx_system_logs_timestamp', timestamp.desc()),
+    )
     
     def to_dict(self):
         return {
@@ -328,15 +467,3 @@ class SystemLog(db.Model):
             'ip_address': self.ip_address,
             'timestamp': self.timestamp.isoformat() if self.timestamp else None
         }
-
-
-# Create indexes for better performance
-db.Index('idx_attendance_timestamp', Attendance.timestamp.desc())
-db.Index('idx_attendance_name_timestamp', Attendance.name, Attendance.timestamp.desc())
-db.Index('idx_persons_status', Person.status)
-db.Index('idx_users_status', User.status)
-db.Index('idx_enrollment_status', EnrollmentRequest.status)
-db.Index('idx_signup_status', SignupRequest.status)
-db.Index('idx_leave_status', LeaveRequest.status)
-db.Index('idx_leave_dates', LeaveRequest.start_date, LeaveRequest.end_date)
-db.Index('idx_system_logs_timestamp', SystemLog.timestamp.desc())
@@ -0,0 +1,62 @@
+"""
+Precompress static assets
+Writes .br and .gz files next to each compressible file in static/ so the
+app can serve them with Content-Encoding instead of compressing per request
+"""
+import os
+import gzip
+
+try:
+    import brotli
+except ImportError:  # brotli comes with Flask-Compress, but don't require it here
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.html', '.svg', '.json', '.txt', '.map')
+
+# Preferred first when the client accepts both
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) if brotli is not None else (('gzip', '.gz'),)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress at the highest level; the cost is paid once, not per request"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(static_dir: str = STATIC_DIR) -> int:
+    """Write compressed siblings for files that are new or changed"""
+    written = 0
+    for root, _, files in os.walk(static_dir):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            for encoding, suffix in ENCODINGS:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+
+                compressed = compress(data, encoding)
+                # Not worth a separate file if it doesn't shrink
+                if len(compressed) >= len(data):
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+
+    return written
+
+
+if __name__ == '__main__':
+    print("Precompressing static assets...")
+    count = precompress()
+    print(f"✓ Wrote {count} compressed files")
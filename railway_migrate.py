@@ -12,7 +12,7 @@ WRONG WAY:
 import os
 import logging
 from sqlalchemy import create_engine, text
-from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.engine import make_url
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -48,67 +48,146 @@ if 'railway.internal' in DATABASE_URL and 'RAILWAY_ENVIRONMENT' not in os.enviro
     logger.error("3. Or deploy to Heroku/Render (they auto-run on deploy)")
     exit(1)
 
-# Fix for SQLAlchemy 1.4+ with PostgreSQL
-if DATABASE_URL.startswith('postgres://'):
-    DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+# Railway/Heroku still hand out postgres:// URLs, a scheme SQLAlchemy 1.4+ rejects
+database_url = make_url(DATABASE_URL)
+if database_url.drivername == 'postgres':
+    database_url = database_url.set(drivername='postgresql')
+
+engine = create_engine(database_url, pool_pre_ping=True)
 
 logger.info(f"✅ Running migration on Railway...")
 
+# Columns added after the initial schema: (table, column, definition)
+MIGRATION_COLUMNS = [
+    # Users table
+    ('users', 'email_verified', 'BOOLEAN DEFAULT FALSE'),
+    ('users', 'verified_at', 'TIMESTAMP'),
+    
+    # Signup requests table
+    ('signup_requests', 'documents', 'TEXT'),
+    ('signup_requests', 'processed_by', 'VARCHAR(255)'),
+    ('signup_requests', 'processed_at', 'TIMESTAMP'),
+    ('signup_requests', 'rejection_reason', 'TEXT'),
+    
+    # Enrollment requests table
+    ('enrollment_requests', 'quality_scores', 'TEXT'),
+    ('enrollment_requests', 'processed_by', 'VARCHAR(255)'),
+    ('enrollment_requests', 'processed_at', 'TIMESTAMP'),
+    ('enrollment_requests', 'rejection_reason', 'TEXT'),
+    
+    # Persons table
+    ('persons', 'embedding_dtype', 'VARCHAR(8)'),  # NULL marks blobs written before the column
+]
+
+# Covering indexes for the attendance lists (Attendance.select_rows reads only these
+# columns, so the lists are index-only scans): (name, CREATE statement)
+COVERING_INDEXES = [
+    ('idx_attendance_ts_cov',
+     "CREATE INDEX CONCURRENTLY idx_attendance_ts_cov ON attendance (timestamp DESC) "
+     "INCLUDE (id, person_id, user_id, name, confidence)"),
+    ('idx_attendance_user_ts_cov',
+     "CREATE INDEX CONCURRENTLY idx_attendance_user_ts_cov ON attendance (user_id, timestamp DESC) "
+     "INCLUDE (id, person_id, name, confidence)"),
+]
+
+# Indexes the covering ones replace, dropped once those are built
+SUPERSEDED_INDEXES = ['idx_attendance_timestamp', 'ix_attendance_timestamp', 'idx_attendance_user_ts']
+
+def build_covering_indexes():
+    """
+    Build the attendance covering indexes and drop the ones they replace
+    CONCURRENTLY doesn't block writes but can't run inside a transaction,
+    so every statement here autocommits on its own
+    """
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if conn.execute(text("SELECT to_regclass('attendance')")).scalar() is None:
+            logger.info("⏭️  attendance table doesn't exist yet")
+            return
+        
+        # indisvalid is false when an earlier CONCURRENTLY build was interrupted
+        existing = dict(conn.execute(text("""
+            SELECT c.relname, i.indisvalid
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE i.indrelid = 'attendance'::regclass
+        """)).fetchall())
+        
+        for name, statement in COVERING_INDEXES:
+            if existing.get(name):
+                logger.info(f"⏭️  {name} already exists")
+                continue
+            if name in existing:
+                conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            conn.exec_driver_sql(statement)
+            logger.info(f"✅ Added {name}")
+        
+        for name in SUPERSEDED_INDEXES:
+            if name in existing:
+                conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                logger.info(f"✅ Dropped {name}")
+
 def migrate_database():
     """Add missing columns to database tables"""
     try:
-        engine = create_engine(DATABASE_URL)
-        
-        with engine.connect() as conn:
+        # One transaction: a single commit for the whole migration
+        with engine.begin() as conn:
             logger.info("✅ Connected to Railway PostgreSQL database")
             
-            # Check and add missing columns to users table
-            logger.info("Checking users table...")
+            # One catalog read decides which statements are still needed
+            catalog = conn.execute(text("""
+                SELECT table_name, column_name, is_nullable, column_default
+                FROM information_schema.columns
+                WHERE table_schema = current_schema()
+            """)).fetchall()
+            columns = {(row.table_name, row.column_name): row.is_nullable for row in catalog}
+            defaults = {(row.table_name, row.column_name): row.column_default for row in catalog}
             
-            migrations = [
-                # Users table
-                ("ALTER TABLE users ADD COLUMN IF NOT EXISTS email_verified BOOLEAN DEFAULT FALSE", "email_verified to users"),
-                ("ALTER TABLE users ADD COLUMN IF NOT EXISTS verified_at TIMESTAMP", "verified_at to users"),
-                
-                # Signup requests table
-                ("ALTER TABLE signup_requests ADD COLUMN IF NOT EXISTS documents TEXT", "documents to signup_requests"),
-                ("ALTER TABLE signup_requests ADD COLUMN IF NOT EXISTS processed_by VARCHAR(255)", "processed_by to signup_requests"),
-                ("ALTER TABLE signup_requests ADD COLUMN IF NOT EXISTS processed_at TIMESTAMP", "processed_at to signup_requests"),
-                ("ALTER TABLE signup_requests ADD COLUMN IF NOT EXISTS rejection_reason TEXT", "rejection_reason to signup_requests"),
-                
-                # Enrollment requests table
-                ("ALTER TABLE enrollment_requests ADD COLUMN IF NOT EXISTS quality_scores TEXT", "quality_scores to enrollment_requests"),
-                ("ALTER TABLE enrollment_requests ADD COLUMN IF NOT EXISTS processed_by VARCHAR(255)", "processed_by to enrollment_requests"),
-                ("ALTER TABLE enrollment_requests ADD COLUMN IF NOT EXISTS processed_at TIMESTAMP", "processed_at to enrollment_requests"),
-                ("ALTER TABLE enrollment_requests ADD COLUMN IF NOT EXISTS rejection_reason TEXT", "rejection_reason to enrollment_requests"),
-                
-                # System logs table - Allow NULL user_id for pre-registration logs
-                ("ALTER TABLE system_logs ALTER COLUMN user_id DROP NOT NULL", "user_id nullable in system_logs"),
-            ]
+            # Tables that don't exist yet are created whole by the app's create_all()
+            tables = {table for table, _ in columns}
             
-            for sql, description in migrations:
-                try:
-                    conn.execute(text(sql))
-                    conn.commit()
-                    logger.info(f"✅ Added {description}")
-                except ProgrammingError as e:
-                    if "already exists" in str(e).lower():
-                        logger.info(f"⏭️  {description} already exists")
-                        conn.rollback()
-                    else:
-                        logger.error(f"❌ Error adding {description}: {e}")
-                        conn.rollback()
-                except Exception as e:
-                    logger.error(f"❌ Error adding {description}: {e}")
-                    conn.rollback()
+            statements = []
+            for table, column, definition in MIGRATION_COLUMNS:
+                if table not in tables:
+                    logger.info(f"⏭️  {table} table doesn't exist yet")
+                elif (table, column) in columns:
+                    logger.info(f"⏭️  {column} to {table} already exists")
+                else:
+                    statements.append((
+                        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}",
+                        f"{column} to {table}"
+                    ))
+            
+            # embedding_dtype used to default to 'float32', which also labelled old
+            # pickles; the app never writes that label, so unlabel those rows
+            if defaults.get(('persons', 'embedding_dtype')) is not None:
+                statements.append((
+                    "UPDATE persons SET embedding_dtype = NULL WHERE embedding_dtype = 'float32'; "
+                    "ALTER TABLE persons ALTER COLUMN embedding_dtype DROP DEFAULT",
+                    "legacy embedding_dtype fix in persons"
+                ))
+            
+            # System logs table - Allow NULL user_id for pre-registration logs
+            if columns.get(('system_logs', 'user_id')) == 'NO':
+                statements.append((
+                    "ALTER TABLE system_logs ALTER COLUMN user_id DROP NOT NULL",
+                    "user_id nullable in system_logs"
+                ))
+            else:
+                logger.info("⏭️  user_id nullable in system_logs already applied")
             
-            logger.info("\n" + "="*50)
-            logger.info("✅ Railway database migration completed!")
-            logger.info("="*50)
-            logger.info("\nYou can now:")
-            logger.info("1. Test signup at your Railway URL")
-            logger.info("2. Access Camera Manager")
-            logger.info("3. Use Enrollment Requests")
+            if statements:
+                conn.exec_driver_sql(";\n".join(sql for sql, _ in statements))
+                for _, description in statements:
+                    logger.info(f"✅ Added {description}")
+        
+        build_covering_indexes()
+        
+        logger.info("\n" + "="*50)
+        logger.info("✅ Railway database migration completed!")
+        logger.info("="*50)
+        logger.info("\nYou can now:")
+        logger.info("1. Test signup at your Railway URL")
+        logger.info("2. Access Camera Manager")
+        logger.info("3. Use Enrollment Requests")
             
     except Exception as e:
         logger.error(f"❌ Migration failed: {e}")
@@ -1,11 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime, timedelta
-from sqlalchemy import func
-import pickle
 import base64
 from models import db, Admin, User, Person, Attendance, EnrollmentRequest, SignupRequest, LeaveRequest, SystemLog, EmailVerification
-from face_service import face_service
 from email_service import email_service
 
 admin_api_bp = Blueprint('admin_api', __name__)
@@ -30,7 +27,7 @@ def get_dashboard_stats():
     
     today = datetime.utcnow().date()
     today_attendance = Attendance.query.filter(
-        func.date(Attendance.timestamp) == today
+        Attendance.on_date(today)
     ).count()
     
     return jsonify({
@@ -44,7 +41,7 @@ def get_dashboard_stats():
 @require_admin
 def get_enrollment_requests():
     status = request.args.get('status', 'pending')
-    requests = EnrollmentRequest.query.filter_by(status=status).order_by(
+    requests = EnrollmentRequest.query.options(db.undefer(EnrollmentRequest.images)).filter_by(status=status).order_by(
         EnrollmentRequest.submitted_at.desc()
     ).all()
     
@@ -55,6 +52,8 @@ def get_enrollment_requests():
 @admin_api_bp.route('/enrollment/requests/<int:request_id>/approve', methods=['POST'])
 @require_admin
 def approve_enrollment_request(request_id):
+    from face_service import face_service
+    
     enroll_req = EnrollmentRequest.query.get(request_id)
     if not enroll_req:
         return jsonify({'error': 'Request not found'}), 404
@@ -63,13 +62,11 @@ def approve_enrollment_request(request_id):
         return jsonify({'error': 'Request already processed'}), 400
     
     try:
-        embeddings = []
-        for img_data in enroll_req.images:
-            image = face_service.base64_to_image(img_data)
-            embedding = face_service.extract_embedding(image)
-            
-            if embedding is not None:
-                embeddings.append(embedding)
+        images = [face_service.base64_to_image(img_data) for img_data in enroll_req.images]
+        embeddings = [
+            embedding for embedding in face_service.extract_embeddings_batch(images)
+            if embedding is not None
+        ]
         
         if len(embeddings) == 0:
             return jsonify({'error': 'No valid faces detected'}), 400
@@ -79,10 +76,9 @@ def approve_enrollment_request(request_id):
         person = Person(
             name=enroll_req.name,
             user_id=enroll_req.user_id,
-            embedding=pickle.dumps(avg_embedding),
-            embedding_dim=len(avg_embedding),
             photos_count=len(embeddings)
         )
+        person.set_embedding(avg_embedding)
         db.session.add(person)
         
         user = User.query.get(enroll_req.user_id)
@@ -155,6 +151,8 @@ def reject_enrollment_request(request_id):
 @admin_api_bp.route('/enrollment/direct', methods=['POST'])
 @require_admin
 def direct_enrollment():
+    from face_service import face_service
+    
     data = request.get_json()
     name = data.get('name')
     images = data.get('images', [])
@@ -163,13 +161,11 @@ def direct_enrollment():
         return jsonify({'error': 'Name and at least 3 images required'}), 400
     
     try:
-        embeddings = []
-        for img_data in images:
-            image = face_service.base64_to_image(img_data)
-            embedding = face_service.extract_embedding(image)
-            
-            if embedding is not None:
-                embeddings.append(embedding)
+        images = [face_service.base64_to_image(img_data) for img_data in images]
+        embeddings = [
+            embedding for embedding in face_service.extract_embeddings_batch(images)
+            if embedding is not None
+        ]
         
         if len(embeddings) < 2:
             return jsonify({'error': 'At least 2 valid faces required'}), 400
@@ -178,10 +174,9 @@ def direct_enrollment():
         
         person = Person(
             name=name,
-            embedding=pickle.dumps(avg_embedding),
-            embedding_dim=len(avg_embedding),
             photos_count=len(embeddings)
         )
+        person.set_embedding(avg_embedding)
         db.session.add(person)
         db.session.commit()
         
@@ -220,14 +215,12 @@ def get_attendance():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
     
-    attendance = Attendance.query.order_by(Attendance.timestamp.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    rows, total, pages = Attendance.page_rows(page=page, per_page=per_page)
     
     return jsonify({
-        'attendance': [a.to_dict() for a in attendance.items],
-        'total': attendance.total,
-        'pages': attendance.pages,
+        'attendance': [Attendance.row_to_dict(a) for a in rows],
+        'total': total,
+        'pages': pages,
         'current_page': page
     })
 
@@ -242,7 +235,7 @@ def get_users():
 @require_admin
 def get_signup_requests():
     status = request.args.get('status', 'pending')
-    requests = SignupRequest.query.filter_by(status=status).order_by(
+    requests = SignupRequest.query.options(db.undefer(SignupRequest.documents)).filter_by(status=status).order_by(
         SignupRequest.submitted_at.desc()
     ).all()
     
@@ -385,7 +378,7 @@ def reject_signup_request(request_id):
 @require_admin
 def get_leave_requests():
     status = request.args.get('status', 'pending')
-    requests = LeaveRequest.query.filter_by(status=status).order_by(
+    requests = LeaveRequest.query.options(db.selectinload(LeaveRequest.user)).filter_by(status=status).order_by(
         LeaveRequest.submitted_at.desc()
     ).all()
     
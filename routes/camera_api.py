@@ -4,7 +4,7 @@ RBAC-protected endpoints for camera operations
 """
 from flask import Blueprint, request, jsonify, Response
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from camera_manager import camera_manager
+from camera_manager import camera_manager, DEVICE_BACKEND
 from models import db, SystemLog
 import logging
 
@@ -260,7 +260,7 @@ def get_available_devices():
         available = []
         
         for i in range(6):
-            cap = cv2.VideoCapture(i, cv2.CAP_DSHOW)
+            cap = cv2.VideoCapture(i, DEVICE_BACKEND)
             if cap.isOpened():
                 available.append({
                     'index': i,
@@ -4,9 +4,8 @@ Enhanced Enrollment Request API with Duplicate Checking
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User, EnrollmentRequest, Person, SystemLog
-from duplicate_checker import duplicate_checker
+from duplicate_checker import get_duplicate_checker
 from background_worker import background_worker, generate_face_embedding_task
-from face_service import face_service
 import os
 import logging
 import base64
@@ -34,6 +33,8 @@ def submit_enrollment_request():
     Submit enrollment request with face images
     Supports both file uploads and base64 encoded images
     """
+    from face_service import face_service
+    
     try:
         identity = get_jwt_identity()
         user_id = identity.get('id')
@@ -147,7 +148,7 @@ def submit_enrollment_request():
         duplicate_results = []
         if embeddings_for_check:
             best_embedding = embeddings_for_check[0]  # Use first good embedding
-            duplicates = duplicate_checker.find_duplicates(best_embedding, k=5, threshold=0.6)
+            duplicates = get_duplicate_checker().find_duplicates(best_embedding, k=5, threshold=0.6)
             duplicate_results = duplicates
         
         return jsonify({
@@ -173,7 +174,9 @@ def get_enrollment_requests():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
         
-        query = EnrollmentRequest.query
+        query = EnrollmentRequest.query.options(
+            db.undefer(EnrollmentRequest.images), db.selectinload(EnrollmentRequest.user)
+        )
         
         if status != 'all':
             query = query.filter_by(status=status)
@@ -204,8 +207,10 @@ def get_enrollment_requests():
 @require_admin
 def get_enrollment_request_detail(request_id):
     """Get detailed enrollment request with duplicate check"""
+    from face_service import face_service
+    
     try:
-        req = EnrollmentRequest.query.get(request_id)
+        req = EnrollmentRequest.query.options(db.joinedload(EnrollmentRequest.user)).get(request_id)
         if not req:
             return jsonify({'error': 'Request not found'}), 404
         
@@ -220,7 +225,7 @@ def get_enrollment_request_detail(request_id):
                 if img is not None:
                     embedding = face_service.get_face_embedding(img)
                     if embedding is not None:
-                        duplicates = duplicate_checker.find_duplicates(embedding, k=5, threshold=0.6)
+                        duplicates = get_duplicate_checker().find_duplicates(embedding, k=5, threshold=0.6)
                         duplicate_results = duplicates
         
         return jsonify({
@@ -275,8 +280,7 @@ def approve_enrollment_request(request_id):
                 background_worker.submit_task(
                     task_id,
                     generate_face_embedding_task,
-                    img_path,
-                    face_service
+                    img_path
                 )
         
         # Log approval
@@ -27,7 +27,7 @@ def get_stats():
     
     today = datetime.utcnow().date()
     today_attendance = Attendance.query.filter(
-        func.date(Attendance.timestamp) == today
+        Attendance.on_date(today)
     ).count()
     
     return jsonify({
@@ -220,12 +220,14 @@ def get_live_attendance():
     limit = request.args.get('limit', 10, type=int)
     today = datetime.utcnow().date()
     
-    attendance_records = Attendance.query.filter(
-        func.date(Attendance.timestamp) == today
-    ).order_by(Attendance.timestamp.desc()).limit(limit).all()
+    attendance_records = db.session.execute(
+        Attendance.select_rows().where(
+            Attendance.on_date(today)
+        ).order_by(Attendance.timestamp.desc()).limit(limit)
+    ).all()
     
     return jsonify({
-        'attendance': [att.to_dict() for att in attendance_records],
+        'attendance': [Attendance.row_to_dict(att) for att in attendance_records],
         'count': len(attendance_records)
     })
 
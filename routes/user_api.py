@@ -2,7 +2,6 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from datetime import datetime
 from models import db, User, EnrollmentRequest, Attendance, Person, LeaveRequest, EmailVerification
-from face_service import face_service
 from email_service import email_service
 import pickle
 from datetime import timedelta
@@ -175,6 +174,8 @@ def get_enrollment_status():
 @user_api_bp.route('/attendance/mark', methods=['POST'])
 @require_user
 def mark_attendance():
+    from face_service import face_service
+    
     identity = get_jwt_identity()
     user_id = identity.get('id')
     
@@ -208,7 +209,7 @@ def mark_attendance():
         existing_attendance = Attendance.query.filter_by(
             user_id=user_id
         ).filter(
-            db.func.date(Attendance.timestamp) == today
+            Attendance.on_date(today)
         ).first()
         
         if existing_attendance:
@@ -245,14 +246,14 @@ def get_attendance_history():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 30, type=int)
     
-    attendance = Attendance.query.filter_by(user_id=user_id).order_by(
-        Attendance.timestamp.desc()
-    ).paginate(page=page, per_page=per_page, error_out=False)
+    rows, total, pages = Attendance.page_rows(
+        Attendance.user_id == user_id, page=page, per_page=per_page
+    )
     
     return jsonify({
-        'attendance': [a.to_dict() for a in attendance.items],
-        'total': attendance.total,
-        'pages': attendance.pages,
+        'attendance': [Attendance.row_to_dict(a) for a in rows],
+        'total': total,
+        'pages': pages,
         'current_page': page
     })
 
@@ -269,12 +270,12 @@ def get_user_stats():
     
     today = datetime.utcnow().date()
     today_marked = Attendance.query.filter_by(user_id=user_id).filter(
-        db.func.date(Attendance.timestamp) == today
+        Attendance.on_date(today)
     ).first() is not None
     
     # Get today's attendance record
     today_record = Attendance.query.filter_by(user_id=user_id).filter(
-        db.func.date(Attendance.timestamp) == today
+        Attendance.on_date(today)
     ).first()
     
     # Calculate late arrivals (after 9:00 AM)
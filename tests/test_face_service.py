@@ -0,0 +1,74 @@
+"""Removing a person from the flat and IVF recognition indexes"""
+import numpy as np
+import pytest
+
+for module in ('faiss', 'cv2', 'deepface'):
+    pytest.importorskip(module)
+
+import face_service as fs  # noqa: E402
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(fs.FaceService, 'load_models', lambda self: None)
+    monkeypatch.setattr(fs.FaceService, '_schedule_save', lambda self: None)
+    return fs.FaceService(index_path=str(tmp_path))
+
+
+def _gallery(n_persons, per_person, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        (person_id, list(rng.standard_normal((per_person, 512)).astype(np.float32)))
+        for person_id in range(1, n_persons + 1)
+    ]
+
+
+def _fill(service, gallery):
+    matrix, ids = service._stack_embeddings(gallery)
+    service.initialize_index(matrix)
+    service._add_normalized(matrix, ids)
+    return matrix, ids
+
+
+def _index_ids(service):
+    return set(fs.faiss.vector_to_array(service.index.id_map).tolist())
+
+
+def _remove_and_check(service, gallery):
+    matrix, ids = _fill(service, gallery)
+    total = service.index.ntotal
+
+    assert service.remove_person(1)
+    assert service.index.ntotal == total - len(gallery[0][1])
+    assert 1 not in service._id_counts
+    assert 1 not in _index_ids(service)
+    assert not service.remove_person(1)
+
+    # A remaining person is still recognized
+    person_id, _ = service.recognize_face(matrix[ids.index(2)])
+    assert person_id == 2
+
+
+def test_remove_person_flat(service):
+    _remove_and_check(service, _gallery(20, 3))
+    base = service._base_index()
+    # faiss-cpu 1.7.4 downcasts IndexFlatIP to a plain IndexFlat
+    assert isinstance(base, fs.faiss.IndexFlat)
+    assert base.metric_type == fs.faiss.METRIC_INNER_PRODUCT
+    assert service.bin_index is not None
+
+
+def test_remove_person_ivf(service):
+    _remove_and_check(service, _gallery(700, 3))
+    assert isinstance(service._base_index(), fs.faiss.IndexRefine)
+
+
+def test_add_persons_moves_large_gallery_to_ivf(service):
+    gallery = _gallery(700, 3)
+    assert service.add_persons(gallery)
+
+    assert isinstance(service._base_index(), fs.faiss.IndexRefine)
+    assert service.index.ntotal == 2100
+    assert service.bin_index is None
+    person_id, _ = service.recognize_face(gallery[1][1][0])
+    assert person_id == 2
@@ -0,0 +1,43 @@
+"""Encoded page responses from the cached template renderer"""
+import gzip
+import os
+import tempfile
+
+import pytest
+
+for module in ('flask_sqlalchemy', 'flask_compress', 'faiss', 'cv2', 'deepface'):
+    pytest.importorskip(module)
+
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db'))
+
+from app import app  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    return app.test_client()
+
+
+def test_page_without_accept_encoding(client):
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_page_gzip(client):
+    plain = client.get('/').data
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == plain
+
+
+def test_page_brotli(client):
+    brotli = pytest.importorskip('brotli')
+    plain = client.get('/').data
+    response = client.get('/', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(response.data) == plain